@@ -0,0 +1,213 @@
+""" Runs the benchmarks against a local Collections API stand-in (see
+benchmarks.server) and prints the results as JSON.
+
+Usage:
+python -m benchmarks.run --items 10000 --item-size 200 --latency 0.001 \
+    --output results.json
+
+"""
+import argparse
+import json
+import platform
+import sys
+import time
+from collector.collection import Collection
+from collector.connection import ConnectionRegistry
+from collector.field import Field
+from collector.model import Model
+from benchmarks.server import CollectionsServer
+
+
+class BenchmarkModel(Model):
+    value = Field()
+    number = Field()
+
+
+def create_collection(server, name, **kwargs):
+    class _BenchmarkCollection(Collection):
+        base_uri = server.base_uri
+        connection_registry = ConnectionRegistry()
+
+    return _BenchmarkCollection('1', name, apikey='benchmark', **kwargs)
+
+
+def generate_items(count, item_size, prefix='item'):
+    value = 'x' * item_size
+    for i in range(count):
+        yield {'_key': '%s%08d' % (prefix, i), 'value': value, 'number': i}
+
+
+def bench_execute(model, options):
+    return sum(1 for _ in model.execute())
+
+
+def bench_execute_raw(model, options):
+    return sum(1 for _ in model.execute(raw=True))
+
+
+def bench_execute_paginated(model, options):
+    return sum(1 for _ in model.page_size(options.page_size).execute())
+
+
+def bench_first(model, options):
+    for i in range(options.operations):
+        model.select('item%08d' % (i % options.items)).execute().first()
+    return options.operations
+
+
+def bench_prefix(model, options):
+    for i in range(options.operations):
+        model.prefix('item%05d' % (i % max(options.items // 1000, 1))) \
+            .execute().all()
+    return options.operations
+
+
+def bench_save(model, options):
+    for item in generate_items(options.operations, options.item_size,
+                               prefix='save'):
+        model.create(**item).save()
+    return options.operations
+
+
+def bench_save_many(model, options):
+    models = [model.create(**item) for item in
+              generate_items(options.items, options.item_size,
+                             prefix='save_many')]
+    model.save_many(models)
+    return len(models)
+
+
+def setup_delete(model, options):
+    model.collection.post_many(generate_items(
+        options.operations, options.item_size, prefix='delete'))
+
+
+def bench_delete(model, options):
+    for i in range(options.operations):
+        model.collection.delete('delete%08d' % i)
+    return options.operations
+
+
+def setup_delete_many(model, options):
+    model.collection.post_many(generate_items(
+        options.items, options.item_size, prefix='delete_many'))
+
+
+def bench_delete_many(model, options):
+    keys = ['delete_many%08d' % i for i in range(options.items)]
+    model.collection.delete_many(keys)
+    return len(keys)
+
+
+# (name, benchmark, setup) triples, setup (if any) prepares the items the
+# benchmark needs and is not timed.
+BENCHMARKS = [
+    ('execute', bench_execute, None),
+    ('execute_raw', bench_execute_raw, None),
+    ('execute_paginated', bench_execute_paginated, None),
+    ('first', bench_first, None),
+    ('prefix', bench_prefix, None),
+    ('save', bench_save, None),
+    ('save_many', bench_save_many, None),
+    ('delete', bench_delete, setup_delete),
+    ('delete_many', bench_delete_many, setup_delete_many),
+]
+
+
+def run_benchmark(name, func, setup, model, options, seed):
+    """ Runs a benchmark options.repeat times and returns its result, the
+    fastest run is reported. The collection is seeded again (by seed) and the
+    setup is run before every run, so that every run starts with the same
+    items.
+    """
+    conn = model.collection.conn
+    runs = []
+    for _ in range(options.repeat):
+        seed()
+        if setup is not None:
+            setup(model, options)
+        requests = conn.requests
+        start = time.time()
+        operations = func(model, options)
+        runs.append((time.time() - start, conn.requests - requests,
+                     operations))
+    seconds, requests, operations = min(runs)
+    return {
+        'name': name,
+        'operations': operations,
+        'requests': requests,
+        'seconds': seconds,
+        'ops_per_second': operations / seconds if seconds else None,
+        'timings': [timing for timing, _, _ in runs],
+    }
+
+
+def run(options):
+    server = CollectionsServer(latency=options.latency).start()
+    try:
+        collection = create_collection(
+            server, 'benchmark', codec=options.codec,
+            decode_processes=options.decode_processes)
+
+        path = collection.endpoint[len(server.base_uri):]
+
+        def seed():
+            server.load(path, generate_items(options.items, options.item_size))
+
+        model = BenchmarkModel(collection)
+        names = set(options.benchmark or [name for name, _, _ in BENCHMARKS])
+        results = [run_benchmark(name, func, setup, model, options, seed)
+                   for name, func, setup in BENCHMARKS if name in names]
+    finally:
+        server.stop()
+    return {
+        'python': platform.python_version(),
+        'codec': collection.iterator_cls.codec.name,
+        'config': {
+            'items': options.items,
+            'item_size': options.item_size,
+            'operations': options.operations,
+            'page_size': options.page_size,
+            'latency': options.latency,
+            'repeat': options.repeat,
+            'decode_processes': options.decode_processes,
+        },
+        'results': results,
+    }
+
+
+def parse_args(args=None):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--items', type=int, default=10000,
+                        help='Number of items in the collection.')
+    parser.add_argument('--item-size', type=int, default=100,
+                        help='Size of the value field of the items.')
+    parser.add_argument('--operations', type=int, default=200,
+                        help='Number of single item operations.')
+    parser.add_argument('--page-size', type=int, default=1000)
+    parser.add_argument('--latency', type=float, default=0.0,
+                        help='Delay of every response in seconds.')
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--codec', default=None)
+    parser.add_argument('--decode-processes', type=int, default=None,
+                        help='Number of processes decoding the results.')
+    parser.add_argument('--benchmark', action='append',
+                        choices=[name for name, _, _ in BENCHMARKS],
+                        help='Benchmark to run, defaults to all of them.')
+    parser.add_argument('--output', default=None,
+                        help='File to write the results to, default is stdout.')
+    return parser.parse_args(args)
+
+
+def main(args=None):
+    options = parse_args(args)
+    output = json.dumps(run(options), indent=2, sort_keys=True)
+    if options.output:
+        with open(options.output, 'w') as f:
+            f.write(output + '\n')
+    else:
+        sys.stdout.write(output + '\n')
+
+
+if __name__ == '__main__':
+    main()
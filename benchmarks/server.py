@@ -0,0 +1,135 @@
+""" Local stand-in for the Collections API, which is used by the benchmarks.
+
+Every collection path (/collections/<project>/<store>/<name>) is backed by
+a LocalCollection. Supported endpoints:
+
+GET <path>?<params>: Queries the collection (key, prefix, prefixcount,
+startts, endts, startafter, count), responds JSON lines.
+POST <path>: Posts JSON lines (optionally gzip compressed).
+POST <path>/deleted: Deletes the keys of the posted JSON lines.
+DELETE <path>/<key>: Deletes the key.
+
+"""
+import gzip
+import threading
+import time
+import zlib
+from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+from SocketServer import ThreadingMixIn
+from StringIO import StringIO
+from urlparse import parse_qsl, urlparse
+from collector.iterators import JsonLinesIterator
+from collector.local import LocalCollection
+
+
+class CollectionsHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    # Responses are written at once, otherwise small writes of the headers
+    # are delayed by keep-alive connections.
+    wbufsize = -1
+    disable_nagle_algorithm = True
+
+    def _get_collection(self, path):
+        # /collections/<project>/<store>/<name>[/<key>]
+        parts = path.strip('/').split('/')
+        if len(parts) < 4 or parts[0] != 'collections':
+            return None, None
+        return (self.server.get_collection('/'.join(parts[1:4])),
+                '/'.join(parts[4:]) or None)
+
+    def _read_body(self):
+        body = self.rfile.read(int(self.headers.get('Content-Length', 0)))
+        if self.headers.get('Content-Encoding') == 'gzip':
+            body = zlib.decompress(body, 16 + zlib.MAX_WBITS)
+        return body
+
+    def _respond(self, body, status=200):
+        time.sleep(self.server.latency)
+        self.send_response(status)
+        if 'gzip' in self.headers.get('Accept-Encoding', '') and body:
+            sio = StringIO()
+            with gzip.GzipFile(fileobj=sio, mode='wb') as f:
+                f.write(body)
+            body = sio.getvalue()
+            self.send_header('Content-Encoding', 'gzip')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        collection, key = self._get_collection(url.path)
+        if collection is None:
+            return self._respond('', 404)
+        params = parse_qsl(url.query)
+        if key is not None:
+            params.append(('key', key))
+        items = collection.request(params)
+        self._respond('\n'.join(JsonLinesIterator.serialize(item)
+                                for item in items))
+
+    def do_POST(self):
+        collection, key = self._get_collection(urlparse(self.path).path)
+        if collection is None:
+            return self._respond('', 404)
+        data = list(JsonLinesIterator(self._read_body()))
+        if key == 'deleted':
+            collection.delete_many(data)
+        else:
+            collection.post_many(data)
+        self._respond('')
+
+    def do_DELETE(self):
+        collection, key = self._get_collection(urlparse(self.path).path)
+        if collection is None or key is None:
+            return self._respond('', 404)
+        collection.delete(key)
+        self._respond('')
+
+    def log_message(self, *args):
+        pass
+
+
+class CollectionsServer(ThreadingMixIn, HTTPServer):
+    """ Threaded HTTP server which emulates the Collections API.
+
+    Parameters:
+    address: (host, port) pair, port 0 picks a free port.
+    latency: Time in seconds every response is delayed by.
+
+    """
+    daemon_threads = True
+
+    def __init__(self, address=('127.0.0.1', 0), latency=0.0):
+        HTTPServer.__init__(self, address, CollectionsHandler)
+        self.latency = latency
+        self.collections = {}
+        self._lock = threading.Lock()
+        self._thread = None
+
+    @property
+    def base_uri(self):
+        return 'http://%s:%d/collections/' % self.server_address
+
+    def get_collection(self, name):
+        """ Returns the LocalCollection of <project>/<store>/<name>. """
+        with self._lock:
+            if name not in self.collections:
+                self.collections[name] = LocalCollection()
+            return self.collections[name]
+
+    def load(self, name, data):
+        """ Replaces the items of <project>/<store>/<name> with given ones. """
+        with self._lock:
+            self.collections[name] = LocalCollection(data)
+
+    def start(self):
+        self._thread = threading.Thread(target=self.serve_forever,
+                                        args=(0.01,))
+        self._thread.daemon = True
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
@@ -0,0 +1,154 @@
+import threading
+from collections import OrderedDict
+from contextlib import contextmanager
+from collector.exceptions import BulkWriteError, WriteBehindError
+
+
+class WriteBehindBuffer(object):
+    """ Queues the items which are posted to a collection and writes them in
+    batches, instead of making a request per post.
+
+    Repeated posts of the same _key are coalesced, only the last one is
+    written. Pending items are written once max_items of them are queued,
+    every interval seconds by a background thread, on flush() and on close()
+    (or on exit, if used as a context manager).
+
+    If writing fails, unwritten items are queued again (unless they are
+    posted again meanwhile) and WriteBehindError is raised by the next add(),
+    flush() or close() call.
+
+    Deletes of the collection discard the pending items of their keys and
+    hold the writes back until the delete is done (see deleting()), so that
+    a deleted item is not written after the delete.
+
+    An item could be queued with a callback, which is called (possibly by
+    the background thread) once the item is written. Callbacks of items which
+    are replaced by a later post of the same _key or discarded are dropped.
+
+    Parameters:
+    collection: Collection instance.
+    max_items: Number of pending items which triggers a write.
+    interval: Maximum time in seconds an item waits in the queue. If None,
+    items are written only when max_items is reached or on explicit flush.
+
+    """
+    def __init__(self, collection, max_items=1000, interval=1.0):
+        self.collection = collection
+        self.max_items = max_items
+        self.interval = interval
+        self.errors = []
+        self._pending = OrderedDict()
+        # Keys discarded during the current write, which are not queued
+        # again if the write fails.
+        self._discarded = set()
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._closed = threading.Event()
+        self._thread = None
+        if interval:
+            self._thread = threading.Thread(target=self._run,
+                                            name='WriteBehindBuffer')
+            self._thread.daemon = True
+            self._thread.start()
+
+    def __len__(self):
+        return len(self._pending)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def _run(self):
+        while not self._closed.wait(self.interval):
+            self._flush()
+
+    def add(self, item, callback=None):
+        """ Queues the item, writes pending items if the queue is full. """
+        self._raise_errors()
+        # Items without _key could not be coalesced.
+        key = item.get('_key')
+        if key is None:
+            key = object()
+        with self._lock:
+            # Re-insert, so that items are written in the order of last posts.
+            self._pending.pop(key, None)
+            self._pending[key] = (item, callback)
+            full = len(self._pending) >= self.max_items
+        if full:
+            self.flush()
+
+    def discard(self, keys):
+        """ Removes pending items of given keys, e.g. as they are deleted. """
+        with self._lock:
+            for key in keys:
+                self._pending.pop(key, None)
+                self._discarded.add(key)
+
+    @contextmanager
+    def deleting(self, keys):
+        """ Context manager which discards pending items of given keys and
+        waits for the current write, if any, then holds the writes back until
+        it exits, so that the keys are deleted after the items are written.
+        """
+        with self._flush_lock:
+            self.discard(keys)
+            yield
+
+    def flush(self):
+        """ Writes all pending items.
+
+        Raises WriteBehindError if writing fails or failed in the background.
+        """
+        self._flush()
+        self._raise_errors()
+
+    def close(self):
+        """ Stops the background thread, writes all pending items and stops
+        queueing posts of the collection.
+
+        Raises WriteBehindError if writing fails or failed in the background.
+        """
+        self._closed.set()
+        if self._thread is not None:
+            self._thread.join()
+        if self.collection.write_buffer is self:
+            self.collection.write_buffer = None
+        self.flush()
+
+    def _flush(self):
+        with self._flush_lock:
+            with self._lock:
+                items = list(self._pending.items())
+                self._pending.clear()
+                self._discarded.clear()
+            if not items:
+                return
+            written = len(items)
+            try:
+                self.collection._post_many(item for _, (item, _) in items)
+            except BulkWriteError as e:
+                written = sum(result.items for result in e.results)
+                self._fail(items[written:], e)
+            except Exception as e:
+                written = 0
+                self._fail(items, e)
+            for _, (_, callback) in items[:written]:
+                if callback is not None:
+                    callback()
+
+    def _fail(self, items, error):
+        with self._lock:
+            pending = OrderedDict((key, item) for key, item in items
+                                  if key not in self._pending and
+                                  key not in self._discarded)
+            pending.update(self._pending)
+            self._pending = pending
+            self.errors.append(error)
+
+    def _raise_errors(self):
+        with self._lock:
+            errors, self.errors = self.errors, []
+        if errors:
+            raise WriteBehindError(errors)
@@ -0,0 +1,118 @@
+import threading
+import time
+from collections import OrderedDict
+
+
+class QueryCache(object):
+    """ Read-through cache of query results, which is used by a collection
+    to avoid requesting the same query again.
+
+    Results are cached by their query parameters, the least recently used ones
+    are evicted once the cache has more than max_entries results or the
+    results take more than max_bytes bytes. The results older than ttl
+    seconds are never returned.
+
+    Parameters:
+    max_entries: Maximum number of cached results.
+    max_bytes: Maximum total size of cached results.
+    ttl: Time to live of a cached result in seconds.
+    clock: Function which returns current time in seconds.
+
+    Attributes:
+    hits: Number of queries which are served by the cache.
+    misses: Number of queries which are not found in the cache.
+    size: Total size of cached results.
+
+    """
+    def __init__(self, max_entries=1000, max_bytes=64 * 1024 * 1024, ttl=60,
+                 clock=time.time):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.clock = clock
+        self.hits = 0
+        self.misses = 0
+        self.size = 0
+        # Incremented on every invalidation, so that a result which is
+        # requested before an invalidation is not cached after it.
+        self.generation = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get(self, params):
+        """ Returns cached result of the query parameters or None. """
+        key = tuple(params)
+        with self._lock:
+            entry = self._entries.pop(key, None)
+            if entry is None or entry.expires < self.clock():
+                if entry is not None:
+                    self.size -= len(entry.body)
+                self.misses += 1
+                return None
+            # Re-insert as the most recently used one.
+            self._entries[key] = entry
+            self.hits += 1
+            return entry.body
+
+    def set(self, params, body, generation=None):
+        """ Caches the result of the query parameters.
+
+        If generation is given and the cache is invalidated since, the result
+        is ignored as it might be stale.
+        """
+        key = tuple(params)
+        entry = _CacheEntry(params, body, self.clock() + self.ttl)
+        with self._lock:
+            if generation is not None and generation != self.generation:
+                return
+            old = self._entries.pop(key, None)
+            if old is not None:
+                self.size -= len(old.body)
+            if len(body) > self.max_bytes:
+                return
+            self._entries[key] = entry
+            self.size += len(body)
+            while (len(self._entries) > self.max_entries
+                   or self.size > self.max_bytes):
+                _, evicted = self._entries.popitem(last=False)
+                self.size -= len(evicted.body)
+
+    def invalidate(self, keys=None):
+        """ Removes the cached results which may contain any of given keys.
+        If keys are not given, removes all results.
+        """
+        with self._lock:
+            self.generation += 1
+            if keys is None:
+                self._entries.clear()
+                self.size = 0
+                return
+            keys = list(keys)
+            for key, entry in self._entries.items():
+                if any(entry.covers(k) for k in keys):
+                    del self._entries[key]
+                    self.size -= len(entry.body)
+
+    def clear(self):
+        """ Removes all cached results. """
+        self.invalidate()
+
+
+class _CacheEntry(object):
+    __slots__ = ('keys', 'prefixes', 'body', 'expires')
+
+    def __init__(self, params, body, expires):
+        self.keys = frozenset(val for name, val in params if name == 'key')
+        self.prefixes = tuple(val for name, val in params if name == 'prefix')
+        self.body = body
+        self.expires = expires
+
+    def covers(self, key):
+        """ Returns whether the result of the entry may contain given key. """
+        if not self.keys and not self.prefixes:
+            return True
+        return key in self.keys or any(key.startswith(prefix)
+                                       for prefix in self.prefixes)
@@ -0,0 +1,123 @@
+import json
+from collections import OrderedDict
+
+try:
+    import ujson
+except ImportError:
+    ujson = None
+
+try:
+    import simplejson
+except ImportError:
+    simplejson = None
+
+
+class JsonCodec(object):
+    """ Encodes and decodes JSON by using the json module of the standard
+    library.
+
+    A batch of lines is decoded as a single JSON array, which is considerably
+    cheaper than decoding every line by its own call.
+    """
+    name = 'json'
+    module = json
+
+    def loads(self, line):
+        return self.module.loads(line)
+
+    def loads_many(self, lines):
+        """ Decodes a list of JSON lines, returns list of data. """
+        if len(lines) == 1:
+            return [self.loads(lines[0])]
+        return self.module.loads('[' + ','.join(lines) + ']')
+
+    def dumps(self, data):
+        return self.module.dumps(data)
+
+    def dumps_many(self, items):
+        """ Encodes a list of data as JSON lines. """
+        dumps = self.module.dumps
+        return '\n'.join([dumps(item) for item in items])
+
+
+class SimpleJsonCodec(JsonCodec):
+    """ Codec of the simplejson library (optional dependency). """
+    name = 'simplejson'
+    module = simplejson
+
+
+class UJsonCodec(JsonCodec):
+    """ Codec of the ujson library (optional dependency), which has to be
+    chosen explicitly.
+
+    Floats are decoded precisely, data which ujson could not handle (e.g.
+    integers of more than 64 bits) is encoded and decoded by the json module
+    instead.
+    """
+    name = 'ujson'
+    module = ujson
+    # ujson 1.x rounds floats unless precise_float is given to loads() and it
+    # encodes floats imprecisely at any double_precision, later versions are
+    # precise (and do not accept precise_float).
+    _legacy = ujson is not None and ujson.__version__.startswith('1.')
+    _loads_kwargs = {'precise_float': True} if _legacy else {}
+
+    def loads(self, line):
+        try:
+            return ujson.loads(line, **self._loads_kwargs)
+        except (OverflowError, ValueError):
+            return json.loads(line)
+
+    def loads_many(self, lines):
+        if len(lines) == 1:
+            return [self.loads(lines[0])]
+        return self.loads('[' + ','.join(lines) + ']')
+
+    def dumps(self, data):
+        if self._legacy:
+            return json.dumps(data)
+        try:
+            return ujson.dumps(data)
+        except (OverflowError, ValueError):
+            return json.dumps(data)
+
+    def dumps_many(self, items):
+        dumps = self.dumps
+        return '\n'.join([dumps(item) for item in items])
+
+
+_codec_classes = OrderedDict(
+    (codec_cls.name, codec_cls)
+    for codec_cls in [SimpleJsonCodec, JsonCodec, UJsonCodec])
+
+# Codecs which are used by default, in the order of preference. ujson is
+# faster, but it is opt-in as it differs from json on edge cases.
+_default_codecs = [SimpleJsonCodec.name, JsonCodec.name]
+
+
+def available_codecs():
+    """ Returns the names of the codecs which could be used, the default one
+    first.
+    """
+    return [name for name, codec_cls in _codec_classes.items()
+            if codec_cls.module is not None]
+
+
+def get_codec(codec=None):
+    """ Returns a codec instance.
+
+    Parameters:
+    codec: Name of the codec (see available_codecs()) or a codec instance.
+    If not given, simplejson is used if it is installed, json otherwise.
+
+    Raises RuntimeError if the codec is unknown or its library is missing.
+    """
+    if codec is None:
+        codec = [name for name in _default_codecs
+                 if name in available_codecs()][0]
+    if not isinstance(codec, basestring):
+        return codec
+    if codec not in available_codecs():
+        raise RuntimeError('Codec %s is not available (available codecs: %s)'
+                           % (codec, ', '.join(available_codecs())))
+    return _codec_classes[codec]()
@@ -1,8 +1,20 @@
 import logging
+from collections import namedtuple
+from contextlib import contextmanager
+from multiprocessing.pool import ThreadPool
 from urllib import urlencode
+from urlparse import urlparse
 from os import environ
-from collector.connection import HttpConnection
+from collector.buffer import WriteBehindBuffer
+from collector.connection import HttpConnection, connection_registry
+from collector.exceptions import BulkWriteError
 from collector.iterators import JsonLinesIterator
+from collector.mirror import CollectionMirror
+from collector.utils import chunks
+
+
+# Result of a single request of a bulk write.
+ChunkResult = namedtuple('ChunkResult', ['items', 'size', 'response'])
 
 
 class Collection(object):
@@ -15,13 +27,50 @@ class Collection(object):
     collection: Collection name.
     apikey: ScrapingHub api key.
     store_type: Storage type (optional, default is 's').
+    cache: QueryCache instance to cache the results of queries (optional),
+    cached results are invalidated by posts and deletes of this collection.
+    codec: JSON codec name or instance which is used by the iterator class
+    (optional, default is the fastest available, see collector.codec).
+    instrumentation: Instrumentation which receives the measurements of the
+    compile, decode and hydrate phases of the queries (optional, defaults to
+    the one of the connection, see collector.instrumentation).
+    decode_processes: Number of processes which decode large results in
+    parallel (optional, see JsonLinesIterator.with_processes), True means
+    the number of CPUs.
+
+    Class attributes:
+    connection_registry: Registry which shares connections between the
+    collections of the same host and api key. If None, every collection
+    creates its own connection.
+    post_max_items: Maximum number of items in a single bulk post request.
+    post_max_bytes: Maximum size of a single bulk post request body.
+    bulk_delete: Whether the bulk delete endpoint is available, otherwise
+    delete_many falls back to concurrent single deletes.
+    delete_max_keys: Maximum number of keys in a single bulk delete request.
+    delete_workers: Number of threads which are used for single deletes.
+    projection_param: Name of the query parameter which restricts the fields
+    returned by the server, if the API supports it (see Query.only). Default
+    is None, then fields are dropped after decoding only.
+    max_url_length: Maximum length of request URLs, longer queries are split
+    into several requests by their keys and prefixes (see Model._request).
 
     """
     base_uri = 'https://storage.scrapinghub.com/collections/'
     http_conn_cls = HttpConnection
+    connection_registry = connection_registry
     iterator_cls = JsonLinesIterator
+    post_max_items = 1000
+    post_max_bytes = 1024 * 1024
+    bulk_delete = True
+    delete_max_keys = 1000
+    delete_workers = 8
+    write_buffer = None
+    projection_param = None
+    max_url_length = 8000
 
-    def __init__(self, projectid, collection, apikey=None, store_type='s'):
+    def __init__(self, projectid, collection, apikey=None, store_type='s',
+                 cache=None, codec=None, instrumentation=None,
+                 decode_processes=None):
         allowed_store_types = ['s', 'cs', 'vs', 'vcs']
         if store_type not in allowed_store_types:
             raise RuntimeError('Invalid store type %s (allowed store types: %s)'
@@ -32,32 +81,177 @@ class Collection(object):
             apikey = environ.get('SH_APIKEY')
             if apikey is None:
                 raise RuntimeError('Apikey must be provided or set as env var.')
-        self.conn = self.http_conn_cls(username=apikey)
+        self.conn = self._get_connection(apikey)
+        self.cache = cache
+        self.instrumentation = instrumentation or getattr(
+            self.conn, 'instrumentation', None)
+        if codec is not None:
+            self.iterator_cls = self.iterator_cls.with_codec(codec)
+        if decode_processes:
+            self.iterator_cls = self.iterator_cls.with_processes(
+                None if decode_processes is True else decode_processes)
         logging.basicConfig()
         self.logger = logging.getLogger('Collection')
 
+    def _get_connection(self, apikey):
+        if self.connection_registry is None:
+            return self.http_conn_cls(username=apikey)
+        host = urlparse(self.base_uri).netloc
+        return self.connection_registry.get(self.http_conn_cls, host, apikey)
+
     def request(self, query):
-        """ Makes a request to the collection database and returns the response.
+        """ Makes a request to the collection database and returns the streamed
+        response.
+
+        If the collection has a cache, the response body is read completely
+        and cached, cached body is returned instead of the response if found.
 
         Parameters:
         query: Query parameters in array of (key,value) pairs (tuple).
 
         """
+        if self.cache is None:
+            return self._request(query)
+        body = self.cache.get(query)
+        if body is None:
+            generation = self.cache.generation
+            body = self._request(query).content
+            self.cache.set(query, body, generation)
+        return body
+
+    def _request(self, query):
         url = self.endpoint + '?' + urlencode(query)
-        self.logger.debug('Requesting: %s' % url)
+        self.logger.debug('Requesting: %s', url)
         return self.conn.request(url)
 
+    def _invalidate(self, keys):
+        if self.cache is not None:
+            self.cache.invalidate(keys)
+
+    def mirror(self, path, refresh=True):
+        """ Returns a CollectionMirror which keeps an on-disk copy of the
+        collection at path and serves the queries of models locally.
+
+        Parameters:
+        path: Path of the data file, the index is saved next to it.
+        refresh: Whether to fetch the items which are written since the
+        last refresh of the mirror.
+
+        """
+        mirror = CollectionMirror(self, path)
+        if refresh:
+            mirror.refresh()
+        return mirror
+
+    def write_behind(self, max_items=None, interval=1.0):
+        """ Starts write-behind mode and returns its WriteBehindBuffer.
+
+        Until the buffer is closed, posts are queued and written in batches
+        (see WriteBehindBuffer). The buffer could be used as a context manager
+        which writes the remaining items and closes the buffer on exit.
+
+        Parameters:
+        max_items: Number of pending items which triggers a write, defaults
+        to post_max_items.
+        interval: Maximum time in seconds an item waits in the queue.
+
+        """
+        if self.write_buffer is not None:
+            raise RuntimeError('Write-behind mode is already started.')
+        self.write_buffer = WriteBehindBuffer(
+            self, max_items=max_items or self.post_max_items, interval=interval)
+        return self.write_buffer
+
     def post(self, data):
         """ Makes a post to the collection database and returns the response.
 
+        In write-behind mode (see write_behind()), data is queued instead and
+        None is returned.
+
         Parameters:
         data: Should be in dict but in theory could be anything that
         serializer of the iterator class (which JsonLines) support.
 
         """
+        if self.write_buffer is not None:
+            for item in (data if isinstance(data, list) else [data]):
+                self.write_buffer.add(item)
+            return
         payload = self.iterator_cls.serialize(data)
-        self.logger.debug('Posting: %s (data: %r)' % (self.endpoint, payload))
-        return self.conn.post(self.endpoint, data=payload)
+        self.logger.debug('Posting: %s (data: %r)', self.endpoint, payload)
+        try:
+            return self.conn.post(self.endpoint, data=payload)
+        finally:
+            self._invalidate(self._get_keys(data))
+
+    @staticmethod
+    def _get_keys(data):
+        """ Returns _key attributes of posted data, or None if any of them
+        is missing.
+        """
+        items = data if isinstance(data, list) else [data]
+        keys = [item.get('_key') for item in items]
+        if None in keys:
+            return None
+        return keys
+
+    def post_many(self, data, max_items=None, max_bytes=None):
+        """ Posts given items to the collection database in as few requests
+        as possible and returns the list of ChunkResult, one per request.
+
+        Items are split into request bodies which have at most max_items
+        items and at most max_bytes bytes (unless a single item is larger).
+
+        Parameters:
+        data: Iterable of items (dicts).
+        max_items: Defaults to post_max_items.
+        max_bytes: Defaults to post_max_bytes.
+
+        In write-behind mode (see write_behind()), items are queued instead
+        and None is returned.
+
+        Raises BulkWriteError if a request fails, which holds the results of
+        the requests made before the failure.
+        """
+        if self.write_buffer is not None:
+            for item in data:
+                self.write_buffer.add(item)
+            return
+        return self._post_many(data, max_items, max_bytes)
+
+    def _post_many(self, data, max_items=None, max_bytes=None):
+        results = []
+        for chunk, keys in self._iter_post_chunks(data, max_items, max_bytes):
+            payload = '\n'.join(chunk)
+            self.logger.debug('Posting: %s (%d items, %d bytes)',
+                              self.endpoint, len(chunk), len(payload))
+            try:
+                response = self.conn.post(self.endpoint, data=payload)
+            except Exception as e:
+                raise BulkWriteError(results, e)
+            finally:
+                self._invalidate(keys)
+            results.append(ChunkResult(len(chunk), len(payload), response))
+        return results
+
+    def _iter_post_chunks(self, data, max_items=None, max_bytes=None):
+        """ Yields (serialized items, keys) pairs, see _get_keys. """
+        max_items = max_items or self.post_max_items
+        max_bytes = max_bytes or self.post_max_bytes
+        chunk, items, size = [], [], 0
+        for item in data:
+            line = self.iterator_cls.serialize(item)
+            # Every line but the first one needs a separator.
+            line_size = len(line) + (1 if chunk else 0)
+            if chunk and (len(chunk) >= max_items
+                          or size + line_size > max_bytes):
+                yield chunk, self._get_keys(items)
+                chunk, items, size, line_size = [], [], 0, len(line)
+            chunk.append(line)
+            items.append(item)
+            size += line_size
+        if chunk:
+            yield chunk, self._get_keys(items)
 
     def delete(self, key):
         """ Makes a delete request to the collection database and returns the
@@ -67,5 +261,69 @@ class Collection(object):
         key: _key attribute of the particular model.
 
         """
-        self.logger.debug('Deleting: %s.' % key)
-        return self.conn.delete(self.endpoint + '/' + key)
+        with self._deleting([key]):
+            return self._delete(key)
+
+    def _delete(self, key):
+        self.logger.debug('Deleting: %s.', key)
+        try:
+            return self.conn.delete(self.endpoint + '/' + key)
+        finally:
+            self._invalidate([key])
+
+    @contextmanager
+    def _deleting(self, keys):
+        # Pending writes of the keys are discarded and the writes are held
+        # back, see WriteBehindBuffer.deleting.
+        if self.write_buffer is None:
+            yield
+        else:
+            with self.write_buffer.deleting(keys):
+                yield
+
+    def delete_many(self, keys, max_keys=None, max_workers=None):
+        """ Deletes given keys from the collection database and returns the
+        list of ChunkResult, one per request.
+
+        Keys are posted in batches of at most max_keys keys to the bulk delete
+        endpoint. If bulk_delete is disabled, every key is deleted by its own
+        request, max_workers of them running concurrently.
+
+        Parameters:
+        keys: Iterable of _key attributes.
+        max_keys: Defaults to delete_max_keys.
+        max_workers: Defaults to delete_workers.
+
+        Raises BulkWriteError if a request fails, which holds the results of
+        the requests made before the failure.
+        """
+        if not self.bulk_delete:
+            return self._delete_concurrently(keys, max_workers)
+        results = []
+        for chunk in chunks(keys, max_keys or self.delete_max_keys):
+            payload = self.iterator_cls.serialize(chunk)
+            self.logger.debug('Deleting: %d keys.', len(chunk))
+            try:
+                with self._deleting(chunk):
+                    response = self.conn.post(self.endpoint + '/deleted',
+                                              data=payload)
+            except Exception as e:
+                raise BulkWriteError(results, e)
+            finally:
+                self._invalidate(chunk)
+            results.append(ChunkResult(len(chunk), len(payload), response))
+        return results
+
+    def _delete_concurrently(self, keys, max_workers=None):
+        keys = list(keys)
+        results = []
+        pool = ThreadPool(max_workers or self.delete_workers)
+        try:
+            with self._deleting(keys):
+                for response in pool.imap(self._delete, keys):
+                    results.append(ChunkResult(1, 0, response))
+        except Exception as e:
+            raise BulkWriteError(results, e)
+        finally:
+            pool.terminate()
+        return results
@@ -0,0 +1,58 @@
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+
+def to_columns(rows, fields):
+    """ Reads given fields of rows (dicts) into per field buffers and returns
+    a dict of field name to numpy masked array.
+
+    Columns whose values are all integers, all numbers or all booleans get
+    int64, float64 and bool arrays respectively, other columns get object
+    arrays. Missing (or None) values are masked.
+
+    Raises RuntimeError if numpy is not installed.
+    """
+    if numpy is None:
+        raise RuntimeError('numpy is required for the columnar export.')
+    fields = list(fields)
+    buffers = [[] for _ in fields]
+    columns = zip(fields, [buf.append for buf in buffers])
+    for row in rows:
+        get = row.get
+        for name, append in columns:
+            append(get(name))
+    return dict((name, _to_array(buf)) for name, buf in zip(fields, buffers))
+
+
+def _infer_dtype(values):
+    types = set(type(value) for value in values if value is not None)
+    if not types:
+        return numpy.float64
+    if types == {bool}:
+        return numpy.bool_
+    if types <= {int, long}:
+        return numpy.int64
+    if types <= {int, long, float}:
+        return numpy.float64
+    return object
+
+
+def _to_array(values):
+    size = len(values)
+    mask = numpy.fromiter((value is None for value in values), dtype=bool,
+                          count=size)
+    dtype = _infer_dtype(values)
+    if dtype is not object:
+        try:
+            data = numpy.array([0 if value is None else value
+                                for value in values], dtype=dtype)
+            return numpy.ma.MaskedArray(data, mask=mask)
+        except OverflowError:
+            # Integers which do not fit into int64.
+            pass
+    data = numpy.empty(size, dtype=object)
+    for index, value in enumerate(values):
+        data[index] = value
+    return numpy.ma.MaskedArray(data, mask=mask)
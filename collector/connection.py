@@ -1,39 +1,198 @@
+import threading
+import time
+import zlib
 import requests
+from requests.adapters import HTTPAdapter
 
 
 class HttpConnection(object):
-    """ Connects to the collection database by using Http protocol. """
-    def __init__(self, username='', password=''):
+    """ Connects to the collection database by using Http protocol.
+
+    Parameters:
+    username: Username (api key) for basic authentication.
+    password: Password for basic authentication.
+    pool_connections: Number of hosts whose connection pools are kept.
+    pool_maxsize: Maximum number of connections kept alive per host.
+    keep_alive: Whether connections are reused, if False, every connection is
+    closed after its request.
+    timeout: Timeout of requests in seconds, either a number or a tuple of
+    (connect timeout, read timeout). Optional, default is no timeout.
+    compress: Whether gzip is used, if True, request bodies of at least
+    compress_min_size bytes are sent gzip compressed and gzip compressed
+    responses are explicitly accepted (and decompressed while they are
+    streamed).
+    compress_min_size: Minimum size of request bodies to be compressed.
+    instrumentation: Instrumentation which receives the measurements of the
+    request and response phases (optional, see
+    collector.instrumentation).
+
+    Attributes:
+    bytes_sent: Size of sent request bodies (compressed, if so).
+    bytes_sent_uncompressed: Size of sent request bodies before compression.
+    bytes_received: Size of received response bodies (compressed, if so).
+    bytes_received_decompressed: Size of received response bodies after
+    decompression.
+
+    """
+    def __init__(self, username='', password='', pool_connections=10,
+                 pool_maxsize=10, keep_alive=True, timeout=None,
+                 compress=False, compress_min_size=1024,
+                 instrumentation=None):
         self.username = username
         self.password = password
+        self.pool_connections = pool_connections
+        self.pool_maxsize = pool_maxsize
+        self.keep_alive = keep_alive
+        self.timeout = timeout
+        self.compress = compress
+        self.compress_min_size = compress_min_size
+        self.instrumentation = instrumentation
+        self.requests = 0
+        self.bytes_sent = 0
+        self.bytes_sent_uncompressed = 0
+        self.bytes_received = 0
+        self.bytes_received_decompressed = 0
+        self._lock = threading.Lock()
         self.session = self._create_session()
 
     def _create_session(self):
         s = requests.Session()
         if self.username:
             s.auth = (self.username, '')
-        s.stream = True
+        adapter = HTTPAdapter(pool_connections=self.pool_connections,
+                              pool_maxsize=self.pool_maxsize)
+        s.mount('http://', adapter)
+        s.mount('https://', adapter)
+        if not self.keep_alive:
+            s.headers['Connection'] = 'close'
+        if self.compress:
+            s.headers['Accept-Encoding'] = 'gzip'
         return s
 
-    def _send_request(self, request):
+    def _count(self, **counts):
+        with self._lock:
+            for name, count in counts.items():
+                setattr(self, name, getattr(self, name) + count)
+
+    def _prepare_body(self, kw):
+        """ Encodes (and compresses) the body, returns its size. """
+        data = kw.get('data')
+        if not isinstance(data, basestring):
+            return 0
+        if isinstance(data, unicode):
+            data = data.encode('utf-8')
+        size = len(data)
+        if self.compress and size >= self.compress_min_size:
+            compressor = zlib.compressobj(6, zlib.DEFLATED,
+                                          16 + zlib.MAX_WBITS)
+            data = compressor.compress(data) + compressor.flush()
+            headers = dict(kw.get('headers') or {})
+            headers['Content-Encoding'] = 'gzip'
+            kw['headers'] = headers
+        kw['data'] = data
+        self._count(bytes_sent=len(data), bytes_sent_uncompressed=size)
+        return len(data)
+
+    def _count_received(self, response):
+        """ Counts the body of the response while it is being read. """
+        iter_content = response.iter_content
+        instrumentation = self.instrumentation
+
+        def counting_iter_content(*args, **kwargs):
+            chunks = iter_content(*args, **kwargs)
+            seconds = 0.0
+            try:
+                while True:
+                    if instrumentation is not None:
+                        start = time.time()
+                        chunk = next(chunks, None)
+                        seconds += time.time() - start
+                    else:
+                        chunk = next(chunks, None)
+                    if chunk is None:
+                        break
+                    self._count(bytes_received_decompressed=len(chunk))
+                    yield chunk
+            finally:
+                self._count(bytes_received=response.raw.tell())
+                if instrumentation is not None:
+                    instrumentation.on_response(
+                        response.url, response.raw.tell(), seconds)
+
+        response.iter_content = counting_iter_content
+
+    def _send_request(self, request, stream=False):
         prepped = self.session.prepare_request(request)
-        response = self.session.send(prepped)
+        with self._lock:
+            self.requests += 1
+        response = self.session.send(prepped, stream=stream,
+                                     timeout=self.timeout)
         return response
 
-    def _do_request(self, method, url, **kw):
+    def _iter_pools(self):
+        for adapter in set(self.session.adapters.values()):
+            pools = adapter.poolmanager.pools
+            for key in pools.keys():
+                pool = pools.get(key)
+                if pool is not None:
+                    yield pool
+
+    def stats(self):
+        """ Returns the statistics of the connection pools as a dict:
+
+        requests: Number of requests made.
+        new_connections: Number of connections opened by the alive pools.
+        reused_connections: Number of requests which reused a connection.
+        pools: Number of alive connection pools (one per host).
+
+        Along with the byte counters, see the attributes of the class.
+        """
+        pools = list(self._iter_pools())
+        new_connections = sum(pool.num_connections for pool in pools)
+        return {
+            'requests': self.requests,
+            'new_connections': new_connections,
+            'reused_connections': max(self.requests - new_connections, 0),
+            'pools': len(pools),
+            'bytes_sent': self.bytes_sent,
+            'bytes_sent_uncompressed': self.bytes_sent_uncompressed,
+            'bytes_received': self.bytes_received,
+            'bytes_received_decompressed': self.bytes_received_decompressed,
+        }
+
+    def close(self):
+        """ Closes all connections of the session. """
+        self.session.close()
+
+    def _do_request(self, method, url, stream=False, **kw):
+        size = self._prepare_body(kw)
         request = requests.Request(method=method, url=url, **kw)
-        response = self._send_request(request)
+        # Always stream, so that the body is read through the counters.
+        response = self._send_request(request, stream=True)
+        if self.instrumentation is not None:
+            # Time until the response headers are parsed.
+            self.instrumentation.on_request(
+                method, url, response.status_code, size,
+                response.elapsed.total_seconds())
         if response.status_code != 200:
+            response.close()
             raise Exception('Server returned unhandled response code: %s'
-                            % response.code)
+                            % response.status_code)
+        self._count_received(response)
+        if stream:
+            return response
         return response.text
 
     def request(self, url, **kw):
-        """ Makes GET http request, returns response.
+        """ Makes GET http request, returns the live response whose body is
+        streamed while it is being iterated.
+
+        The response should be either consumed completely or closed, so that
+        the connection is released back to the pool.
 
         Raises Exception if response' status code is not 200.
         """
-        return self._do_request(method='GET', url=url, **kw)
+        return self._do_request(method='GET', url=url, stream=True, **kw)
 
     def post(self, url, **kw):
         """ Makes POST http request, returns response.
@@ -48,3 +207,71 @@ class HttpConnection(object):
         Raises Exception if response' status code is not 200.
         """
         return self._do_request(method='DELETE', url=url, **kw)
+
+
+class ConnectionRegistry(object):
+    """ Shares connections between collections, a single connection (and so
+    a single connection pool) is created for every connection class, host
+    and username combination.
+
+    Parameters:
+    Keyword arguments which are passed to the connections on creation, such
+    as pool_maxsize, keep_alive and timeout (see HttpConnection).
+
+    """
+    def __init__(self, **options):
+        self.options = options
+        self.created = 0
+        self.reused = 0
+        self._connections = {}
+        self._lock = threading.Lock()
+
+    def configure(self, **options):
+        """ Updates the options of the connections which are created
+        afterwards.
+        """
+        self.options.update(options)
+
+    def get(self, conn_cls, host, username):
+        """ Returns the connection of given class for host and username,
+        creates it if it does not exist yet.
+        """
+        key = (conn_cls, host, username)
+        with self._lock:
+            conn = self._connections.get(key)
+            if conn is None:
+                conn = conn_cls(username=username, **self.options)
+                self._connections[key] = conn
+                self.created += 1
+            else:
+                self.reused += 1
+        return conn
+
+    def stats(self):
+        """ Returns the statistics as a dict of created and reused
+        connections, along with the list of statistics of every connection
+        (see HttpConnection.stats) including its host.
+        """
+        with self._lock:
+            items = list(self._connections.items())
+        connections = []
+        for (_, host, _), conn in items:
+            conn_stats = conn.stats()
+            conn_stats['host'] = host
+            connections.append(conn_stats)
+        return {
+            'created': self.created,
+            'reused': self.reused,
+            'connections': connections,
+        }
+
+    def clear(self):
+        """ Closes and forgets all connections. """
+        with self._lock:
+            connections, self._connections = self._connections, {}
+        for conn in connections.values():
+            conn.close()
+
+
+# Default registry which is used by collections.
+connection_registry = ConnectionRegistry()
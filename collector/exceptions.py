@@ -1,2 +1,30 @@
 class NoSuchElement(Exception):
     pass
+
+
+class BulkWriteError(Exception):
+    """ Raised when a chunk of a bulk write fails.
+
+    Attributes:
+    results: Results of the chunks which are written before the failure.
+    error: The exception which is raised by the failing chunk.
+    """
+    def __init__(self, results, error):
+        super(BulkWriteError, self).__init__(
+            'Bulk write failed after %d chunk(s): %s' % (len(results), error))
+        self.results = results
+        self.error = error
+
+
+class WriteBehindError(Exception):
+    """ Raised when queued items of a write-behind buffer could not be
+    written.
+
+    Attributes:
+    errors: The exceptions which are raised by the failing writes.
+    """
+    def __init__(self, errors):
+        super(WriteBehindError, self).__init__(
+            'Writing queued items failed %d time(s), last error: %s'
+            % (len(errors), errors[-1]))
+        self.errors = errors
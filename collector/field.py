@@ -7,6 +7,9 @@ class FieldDescriptor(object):
 
     def __set__(self, instance, value):
         instance.__dict__[self.name] = value
+        track_change = getattr(instance, '_track_change', None)
+        if track_change is not None:
+            track_change(self.name, value)
 
 
 class Field(object):
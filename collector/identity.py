@@ -0,0 +1,58 @@
+import threading
+
+
+class IdentityMap(object):
+    """ Keeps a single model instance per model class, collection and _key,
+    so that the same data which is fetched by different queries is
+    represented by the same instance.
+
+    An identity map is meant to be used for a unit of work, it could be used
+    as a context manager which clears the map on exit.
+
+    Example:
+
+    with IdentityMap() as identity_map:
+        fm.identity_map = identity_map
+        foo = fm.select('foo').execute().first()
+        assert foo is fm.prefix('fo').execute().first()
+
+    """
+    def __init__(self):
+        self._models = {}
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._models)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.clear()
+
+    @staticmethod
+    def _identity(model):
+        return type(model), model.collection, model._key
+
+    def get(self, model_cls, collection, key):
+        """ Returns the model instance of given class, collection and key,
+        or None.
+        """
+        return self._models.get((model_cls, collection, key))
+
+    def add(self, model):
+        """ Adds the model instance to the map and returns the instance which
+        is kept by the map (which may be another instance of the same key).
+        """
+        with self._lock:
+            return self._models.setdefault(self._identity(model), model)
+
+    def remove(self, model):
+        """ Removes the model instance from the map. """
+        with self._lock:
+            self._models.pop(self._identity(model), None)
+
+    def clear(self):
+        """ Removes all model instances from the map. """
+        with self._lock:
+            self._models.clear()
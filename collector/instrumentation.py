@@ -0,0 +1,93 @@
+import threading
+
+
+class Instrumentation(object):
+    """ Receives the measurements of the request pipeline, every method is
+    called once per call of its phase. The methods do nothing, a subclass
+    should override the ones it is interested in.
+
+    Instrumentation could be given to a collection (compile, decode and
+    hydrate phases) and to a connection (request and response phases). A
+    collection uses the instrumentation of its connection unless it is given
+    one, hence configuring the connection registry instruments every phase:
+
+    connection_registry.configure(instrumentation=PhaseStats())
+
+    Methods might be called from multiple threads.
+    """
+    def on_compile(self, params, seconds):
+        """ Query chain is compiled into params. """
+
+    def on_request(self, method, url, status_code, bytes_sent, seconds):
+        """ Request is sent and the response headers are received (the first
+        byte), seconds is the time until then.
+        """
+
+    def on_response(self, url, bytes_received, seconds):
+        """ Response body is read, seconds is the time spent on reading it
+        (not including the time the body is waiting to be consumed).
+        """
+
+    def on_decode(self, rows, seconds):
+        """ JSON lines of a result are decoded. """
+
+    def on_hydrate(self, rows, seconds):
+        """ Model instances of a result are created. """
+
+
+class PhaseStats(Instrumentation):
+    """ Instrumentation which sums up the measurements per phase.
+
+    Attributes:
+    status_codes: Dict of status code to number of responses.
+
+    """
+    phases = ['compile', 'request', 'response', 'decode', 'hydrate']
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.clear()
+
+    def clear(self):
+        with self._lock:
+            self._stats = dict((phase, {'calls': 0, 'seconds': 0.0})
+                               for phase in self.phases)
+            self._stats['request']['bytes'] = 0
+            self._stats['response']['bytes'] = 0
+            self._stats['decode']['rows'] = 0
+            self._stats['hydrate']['rows'] = 0
+            self.status_codes = {}
+
+    def _add(self, phase, seconds, **counts):
+        with self._lock:
+            stats = self._stats[phase]
+            stats['calls'] += 1
+            stats['seconds'] += seconds
+            for name, count in counts.items():
+                stats[name] += count
+
+    def stats(self):
+        """ Returns a dict of phase to its calls, seconds and bytes or rows
+        (if it has them).
+        """
+        with self._lock:
+            return dict((phase, dict(stats))
+                        for phase, stats in self._stats.items())
+
+    def on_compile(self, params, seconds):
+        self._add('compile', seconds)
+
+    def on_request(self, method, url, status_code, bytes_sent, seconds):
+        self._add('request', seconds, bytes=bytes_sent)
+        with self._lock:
+            self.status_codes[status_code] = self.status_codes.get(
+                status_code, 0) + 1
+
+    def on_response(self, url, bytes_received, seconds):
+        self._add('response', seconds, bytes=bytes_received)
+
+    def on_decode(self, rows, seconds):
+        self._add('decode', seconds, rows=rows)
+
+    def on_hydrate(self, rows, seconds):
+        self._add('hydrate', seconds, rows=rows)
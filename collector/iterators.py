@@ -1,19 +1,253 @@
-import json
-from io import StringIO
+import atexit
+import multiprocessing
+import threading
+import time
+from Queue import Queue
+from collections import deque
+from itertools import chain
+from collector.codec import get_codec
+
+# Process pools which decode in parallel, by number of processes.
+_pools = {}
+_pools_lock = threading.Lock()
+
+
+def _get_pool(processes):
+    with _pools_lock:
+        pool = _pools.get(processes)
+        if pool is None:
+            pool = _pools[processes] = multiprocessing.Pool(processes)
+        return pool
+
+
+def start_pool(processes=None):
+    """ Starts the process pool which decodes for
+    JsonLinesIterator.with_processes(processes), unless it is running.
+
+    Pools are started on their first use otherwise. The worker processes are
+    forked, so a pool should be started before any other thread is (a
+    process forked while another thread holds a lock, e.g. of logging,
+    inherits the lock held and might deadlock), hence a multithreaded
+    program should start the pool at the start.
+    """
+    _get_pool(processes or multiprocessing.cpu_count())
+
+
+def close_pools():
+    """ Terminates the process pools which are used for decoding, which is
+    done at exit as well.
+    """
+    with _pools_lock:
+        pools = _pools.values()
+        _pools.clear()
+    for pool in pools:
+        pool.terminate()
+        pool.join()
+
+
+atexit.register(close_pools)
+
+
+def _decode_chunk(codec_name, chunk):
+    # Runs in a worker process, hence the codec is passed by its name.
+    return get_codec(codec_name).loads_many(chunk.split('\n'))
+
+
+def _try_decode_chunk(codec_name, chunk):
+    # The callback of apply_async is not called on failures, so the error is
+    # returned instead.
+    try:
+        return _decode_chunk(codec_name, chunk)
+    except Exception as e:
+        return e
+
+
+class _PendingChunks(object):
+    """ Chunks which are submitted to a process pool to be decoded. They
+    are popped in the order of submission if ordered, otherwise as soon as
+    they are decoded (the pool puts them into a queue, as it decodes them).
+    """
+    def __init__(self, pool, codec_name, ordered):
+        self.pool = pool
+        self.codec_name = codec_name
+        self.ordered = ordered
+        self._results = deque()
+        self._decoded = Queue()
+        self._count = 0
+
+    def __len__(self):
+        return self._count
+
+    def submit(self, chunk):
+        if self.ordered:
+            self._results.append(self.pool.apply_async(
+                _decode_chunk, (self.codec_name, chunk)))
+        else:
+            self.pool.apply_async(_try_decode_chunk, (self.codec_name, chunk),
+                                  callback=self._decoded.put)
+        self._count += 1
+
+    def pop(self):
+        self._count -= 1
+        if self.ordered:
+            return self._results.popleft().get()
+        decoded = self._decoded.get()
+        if isinstance(decoded, Exception):
+            raise decoded
+        return decoded
 
 
 class JsonLinesIterator(object):
-    def __init__(self, data):
-        data = unicode(data) if data else None
-        self.sio = StringIO(data)
+    """ Decodes JSON lines as they are read.
+
+    The data could be a string, a streamed http response (anything which
+    provides iter_lines) or any iterable of lines.
+
+    Lines are decoded in batches by the codec of the class. The first batch
+    has a single line, so that the first data is available as soon as
+    possible, then the batch size grows up to max_batch_size.
+
+    If processes is set (see with_processes()), lines are joined into chunks
+    of about parallel_chunk_size bytes, which are decoded on a process pool.
+    Data is yielded in order, unless ordered is False, then chunks are
+    yielded as soon as they are decoded. Data which fits into a single chunk
+    is decoded by the current process. The codec should be one of the
+    available codecs (see collector.codec).
+
+    If instrumentation is given, the number of decoded lines and the time
+    spent on decoding them (or waiting for them, if decoded in parallel) are
+    reported to it once the data is consumed.
+    """
+    chunk_size = 64 * 1024
+    max_batch_size = 128
+    codec = get_codec()
+    processes = None
+    ordered = True
+    parallel_chunk_size = 1024 * 1024
+
+    def __init__(self, data, instrumentation=None):
+        self.data = data
+        self.instrumentation = instrumentation
+
+    @classmethod
+    def with_codec(cls, codec):
+        """ Returns a subclass which uses given codec (a codec instance or
+        name, see collector.codec.get_codec).
+        """
+        return type(cls.__name__, (cls,), {'codec': get_codec(codec)})
+
+    @classmethod
+    def with_processes(cls, processes=None, ordered=True):
+        """ Returns a subclass which decodes on a pool of given number of
+        processes (defaults to the number of CPUs). The pool is started by
+        the first result to decode, see start_pool() for starting it before
+        threads are started.
+        """
+        processes = processes or multiprocessing.cpu_count()
+        return type(cls.__name__, (cls,), {'processes': processes,
+                                           'ordered': ordered})
+
+    def _iter_lines(self):
+        data = self.data
+        if not data:
+            return iter([])
+        if isinstance(data, basestring):
+            return iter(data.split('\n'))
+        if hasattr(data, 'iter_lines'):
+            return data.iter_lines(chunk_size=self.chunk_size)
+        return iter(data)
 
     def __iter__(self):
-        for line in self.sio:
-            yield json.loads(line)
+        if self.instrumentation is not None:
+            return self._iter_measured()
+        if self.processes:
+            return self._iter_parallel(self.codec.loads_many,
+                                       self._pop_decoded)
+        return self._iter_batches(self.codec.loads_many)
+
+    def _iter_chunks(self):
+        chunk, size = [], 0
+        for line in self._iter_lines():
+            if not line:
+                continue
+            chunk.append(line)
+            size += len(line) + 1
+            if size >= self.parallel_chunk_size:
+                yield chunk
+                chunk, size = [], 0
+        if chunk:
+            yield chunk
+
+    def _iter_parallel(self, loads_many, pop_decoded):
+        chunks = self._iter_chunks()
+        first = next(chunks, None)
+        second = next(chunks, None)
+        if second is None:
+            for data in (loads_many(first) if first else []):
+                yield data
+            return
+        pending = _PendingChunks(_get_pool(self.processes), self.codec.name,
+                                 self.ordered)
+        # Submitted chunks are limited, so that the body is not read faster
+        # than it is decoded.
+        max_pending = 2 * self.processes
+        for chunk in chain([first, second], chunks):
+            pending.submit('\n'.join(chunk))
+            if len(pending) >= max_pending:
+                for data in pop_decoded(pending):
+                    yield data
+        while pending:
+            for data in pop_decoded(pending):
+                yield data
+
+    def _pop_decoded(self, pending):
+        """ Removes a decoded chunk from the pending ones and returns it,
+        the first one if ordered, otherwise the first one which is ready.
+        """
+        return pending.pop()
+
+    def _iter_batches(self, loads_many):
+        batch, batch_size = [], 1
+        for line in self._iter_lines():
+            if not line:
+                continue
+            batch.append(line)
+            if len(batch) >= batch_size:
+                for data in loads_many(batch):
+                    yield data
+                batch = []
+                batch_size = min(batch_size * 2, self.max_batch_size)
+        if batch:
+            for data in loads_many(batch):
+                yield data
+
+    def _iter_measured(self):
+        stats = {'rows': 0, 'seconds': 0.0}
+
+        def measure(func):
+            def measured(arg):
+                start = time.time()
+                decoded = func(arg)
+                stats['seconds'] += time.time() - start
+                stats['rows'] += len(decoded)
+                return decoded
+            return measured
+
+        loads_many = measure(self.codec.loads_many)
+        if self.processes:
+            data = self._iter_parallel(loads_many,
+                                       measure(self._pop_decoded))
+        else:
+            data = self._iter_batches(loads_many)
+        try:
+            for item in data:
+                yield item
+        finally:
+            self.instrumentation.on_decode(stats['rows'], stats['seconds'])
 
-    @staticmethod
-    def serialize(data):
+    @classmethod
+    def serialize(cls, data):
         if isinstance(data, list):
-            return '\n'.join([json.dumps(line) for line in data])
+            return cls.codec.dumps_many(data)
         else:
-            return json.dumps(data)
\ No newline at end of file
+            return cls.codec.dumps(data)
@@ -0,0 +1,136 @@
+import threading
+import time
+from bisect import bisect_left
+from itertools import islice
+from collector.collection import ChunkResult
+from collector.mirror import select_keys
+from collector.utils import SortedKeys
+
+
+class LocalCollection(object):
+    """ In-process collection which could be used instead of a Collection,
+    e.g. by offline jobs and tests.
+
+    Items are kept in a hash index by _key, queries are answered by a sorted
+    key index (see SortedKeys, prefix ranges and startafter are found by
+    bisection) and a _ts index (for when() queries). Like the server, the
+    collection assigns _ts of the posted items, which is increasing, hence
+    the _ts index is appended to. Stale entries of the _ts index are dropped
+    lazily.
+
+    Parameters:
+    data: Initial items (optional), their _ts is kept if they have one.
+    clock: Function which returns current time in seconds.
+
+    """
+    iterator_cls = iter
+    projection_param = None
+
+    def __init__(self, data=None, clock=time.time):
+        self.clock = clock
+        self._items = {}
+        self._keys = SortedKeys()
+        self._ts_index = []
+        self._stale_ts = 0
+        self._last_ts = 0
+        self._lock = threading.RLock()
+        if data:
+            self._load(data)
+
+    def __len__(self):
+        return len(self._items)
+
+    def _load(self, data):
+        for item in data:
+            item = dict(item)
+            if item.get('_ts') is None:
+                item['_ts'] = self._next_ts()
+            else:
+                self._last_ts = max(self._last_ts, item['_ts'])
+            self._items[item['_key']] = item
+        self._keys = SortedKeys(self._items)
+        self._ts_index = sorted((item['_ts'], key)
+                                for key, item in self._items.iteritems())
+
+    def _next_ts(self):
+        self._last_ts = max(int(self.clock() * 1000), self._last_ts + 1)
+        return self._last_ts
+
+    def _get_ts(self, key):
+        return self._items[key]['_ts']
+
+    def _ts_range(self, startts, endts):
+        index = self._ts_index
+        start = 0 if startts is None else bisect_left(index, (startts,))
+        end = len(index) if endts is None else bisect_left(
+            index, (endts + 1,), start)
+        items = self._items
+        return (key for ts, key in islice(index, start, end)
+                if key in items and items[key]['_ts'] == ts)
+
+    def request(self, params=None):
+        """ Returns the list of items which match the query parameters (see
+        Collection.request).
+        """
+        with self._lock:
+            keys = select_keys(params or [], self._keys,
+                               self._get_ts, self._ts_range)
+            return [dict(self._items[key]) for key in keys]
+
+    def _store(self, item):
+        key = item.get('_key')
+        if key is None:
+            raise ValueError('Item has no _key: %r' % (item,))
+        item = dict(item)
+        item['_ts'] = self._next_ts()
+        old = self._items.get(key)
+        if old is None:
+            self._keys.add(key)
+        else:
+            self._stale_ts += 1
+        self._items[key] = item
+        self._ts_index.append((item['_ts'], key))
+
+    def _compact_ts_index(self):
+        if self._stale_ts > len(self._items):
+            items = self._items
+            self._ts_index = [(ts, key) for ts, key in self._ts_index
+                              if key in items and items[key]['_ts'] == ts]
+            self._stale_ts = 0
+
+    def post(self, data):
+        """ Stores given item (or list of items) by its _key. """
+        with self._lock:
+            for item in (data if isinstance(data, list) else [data]):
+                self._store(item)
+            self._compact_ts_index()
+
+    def post_many(self, data, **kwargs):
+        """ Stores given items and returns a single ChunkResult (see
+        Collection.post_many).
+        """
+        with self._lock:
+            count = 0
+            for item in data:
+                self._store(item)
+                count += 1
+            self._compact_ts_index()
+        return [ChunkResult(count, 0, None)]
+
+    def delete(self, key):
+        """ Removes the item of given key, if there is one. """
+        self.delete_many([key])
+
+    def delete_many(self, keys, **kwargs):
+        """ Removes the items of given keys and returns a single ChunkResult
+        (see Collection.delete_many).
+        """
+        with self._lock:
+            count = 0
+            for key in keys:
+                if self._items.pop(key, None) is not None:
+                    self._keys.discard(key)
+                    self._stale_ts += 1
+                count += 1
+            self._compact_ts_index()
+        return [ChunkResult(count, 0, None)]
@@ -0,0 +1,321 @@
+import heapq
+import json
+import mmap
+import os
+import threading
+from itertools import islice
+from collector.utils import SortedKeys
+
+
+def select_keys(params, keys, get_ts, ts_range=None):
+    """ Evaluates query parameters of the Collections API against a local
+    index and returns the matching keys in key order.
+
+    Parameters:
+    params: Query parameters in array of (key,value) pairs (tuple), key,
+    prefix, prefixcount, startts, endts, startafter and count are applied,
+    the others are ignored.
+    keys: SortedKeys of the available keys.
+    get_ts: Function which returns _ts of a key (or None if it is unknown).
+    ts_range: Function which returns the keys having _ts between given
+    startts and endts (either could be None), to use an index for when()
+    queries (optional).
+
+    """
+    selected, prefixes = [], []
+    prefixcount = startts = endts = startafter = count = None
+    for name, value in params:
+        if name == 'key':
+            selected.append(value)
+        elif name == 'prefix':
+            prefixes.append(value)
+        elif name == 'prefixcount':
+            prefixcount = int(value)
+        elif name == 'startts':
+            startts = int(value)
+        elif name == 'endts':
+            endts = int(value)
+        elif name == 'startafter':
+            startafter = value
+        elif name == 'count':
+            count = int(value)
+
+    def matches(key):
+        if startts is None and endts is None:
+            return True
+        ts = get_ts(key)
+        return (ts is not None
+                and (startts is None or ts >= startts)
+                and (endts is None or ts <= endts))
+
+    def first(candidates):
+        # Keys after startafter, in order, at most count of them, without
+        # sorting all of the candidates.
+        if startafter is not None:
+            candidates = (key for key in candidates if key > startafter)
+        if count is not None:
+            return heapq.nsmallest(count, candidates)
+        return sorted(candidates)
+
+    if not selected and not prefixes and ts_range is not None and (
+            startts is not None or endts is not None):
+        return first(ts_range(startts, endts))
+    if not selected and not prefixes:
+        start = (iter(keys) if startafter is None
+                 else keys.iter_from(startafter, after=True))
+        return list(islice((key for key in start if matches(key)), count))
+    candidates = set()
+    for key in selected:
+        if key in keys and matches(key):
+            candidates.add(key)
+    for prefix in prefixes:
+        found = 0
+        for key in keys.iter_from(prefix):
+            if not key.startswith(prefix):
+                break
+            if prefixcount is not None and found >= prefixcount:
+                break
+            if matches(key):
+                candidates.add(key)
+                found += 1
+    return first(candidates)
+
+
+class CollectionMirror(object):
+    """ On-disk copy of a collection which serves the queries of models
+    locally and is refreshed incrementally, see Collection.mirror().
+
+    Items are appended to a JSON lines data file, which is read via mmap,
+    an index of _key to (offset, length, _ts) is saved next to it (path with
+    .index suffix). A refresh requests only the items which are written
+    since the newest _ts of the mirror (items which have the same _ts as in
+    the mirror are skipped), updated items are appended again and the data
+    file is compacted once the stale lines of updated or deleted items take
+    more space than the live ones.
+
+    Posts and deletes are sent to the collection and applied to the mirror
+    right away. Posted items have no _ts until the next refresh, hence they
+    are not matched by when() queries until then. Items which are deleted
+    by the others are only noticed by a full refresh.
+
+    Writes update the index in memory, it is saved by refresh(), compact()
+    and close(). If the process ends before, the posted items are fetched
+    again by the next refresh, but the deleted ones stay until a full
+    refresh.
+
+    Parameters:
+    collection: Collection instance to mirror.
+    path: Path of the data file.
+
+    """
+    projection_param = None
+
+    def __init__(self, collection, path):
+        self.collection = collection
+        self.path = path
+        self.index_path = path + '.index'
+        self.iterator_cls = collection.iterator_cls
+        self.last_ts = None
+        self._index = {}
+        self._keys = SortedKeys()
+        self._size = 0
+        # Size of the lines of the items in the index.
+        self._live = 0
+        self._map = None
+        self._lock = threading.RLock()
+        self._load()
+
+    def __len__(self):
+        return len(self._index)
+
+    def _load(self):
+        if not os.path.exists(self.path) or not os.path.exists(
+                self.index_path):
+            self._reset()
+            return
+        with open(self.index_path) as f:
+            state = json.load(f)
+        self.last_ts = state['last_ts']
+        self._index = dict((key, tuple(entry))
+                           for key, entry in state['keys'].iteritems())
+        self._size = os.path.getsize(self.path)
+        self._live = sum(length + 1 for _, length, _ in
+                         self._index.itervalues())
+        self._keys = SortedKeys(self._index)
+        self._remap()
+
+    def _save(self):
+        state = {'last_ts': self.last_ts, 'keys': self._index}
+        tmp_path = self.index_path + '.tmp'
+        with open(tmp_path, 'w') as f:
+            json.dump(state, f)
+        os.rename(tmp_path, self.index_path)
+
+    def _reset(self):
+        self._close_map()
+        open(self.path, 'w').close()
+        self.last_ts = None
+        self._index = {}
+        self._keys = SortedKeys()
+        self._size = 0
+        self._live = 0
+        self._save()
+
+    def _remap(self):
+        self._close_map()
+        if self._size:
+            with open(self.path, 'rb') as f:
+                self._map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+    def _close_map(self):
+        if self._map is not None:
+            self._map.close()
+            self._map = None
+
+    def _get_ts(self, key):
+        return self._index[key][2]
+
+    def _read(self, key):
+        offset, length, _ = self._index[key]
+        # The data file is mapped again only when appended lines are read.
+        if self._map is None or offset + length > len(self._map):
+            self._remap()
+        return self._map[offset:offset + length]
+
+    def _write(self, items, track_ts):
+        """ Appends items to the data file and updates the index. If track_ts
+        is True, the items are fetched from the collection and the ones which
+        the mirror has with the same _ts are skipped.
+        """
+        serialize = self.iterator_cls.serialize
+        index = self._index
+        written = 0
+        with open(self.path, 'ab') as f:
+            for item in items:
+                key = item.get('_key')
+                if key is None:
+                    continue
+                ts = item.get('_ts')
+                if track_ts and ts is not None and key in index and (
+                        index[key][2] == ts):
+                    continue
+                line = serialize(item)
+                if isinstance(line, unicode):
+                    line = line.encode('utf-8')
+                if key in index:
+                    self._live -= index[key][1] + 1
+                else:
+                    self._keys.add(key)
+                index[key] = (self._size, len(line), ts)
+                self._live += len(line) + 1
+                f.write(line + '\n')
+                self._size += len(line) + 1
+                written += 1
+                if track_ts and ts is not None and (
+                        self.last_ts is None or ts > self.last_ts):
+                    self.last_ts = ts
+        return written
+
+    def _live_size(self):
+        return self._live
+
+    def compact(self):
+        """ Rewrites the data file without the stale lines. """
+        with self._lock:
+            tmp_path = self.path + '.tmp'
+            index = {}
+            offset = 0
+            with open(tmp_path, 'wb') as f:
+                for key in self._keys:
+                    line = self._read(key)
+                    index[key] = (offset, len(line), self._get_ts(key))
+                    f.write(line + '\n')
+                    offset += len(line) + 1
+            self._close_map()
+            os.rename(tmp_path, self.path)
+            self._index = index
+            self._size = self._live = offset
+            self._remap()
+            self._save()
+
+    def _compact_if_stale(self):
+        if self._size > 2 * self._live:
+            self.compact()
+            return True
+        return False
+
+    def refresh(self, full=False):
+        """ Fetches the items which are written since the last refresh and
+        returns their number.
+
+        Parameters:
+        full: If True, the whole collection is fetched again, which drops the
+        items deleted by the others.
+
+        """
+        with self._lock:
+            if full:
+                self._reset()
+            params = [('meta', '_key'), ('meta', '_ts')]
+            if self.last_ts is not None:
+                params.insert(0, ('startts', self.last_ts))
+            result = self.collection.request(params)
+            written = self._write(self.iterator_cls(result), track_ts=True)
+            if not self._compact_if_stale():
+                self._save()
+            return written
+
+    def request(self, params):
+        """ Returns the result of query parameters from the mirror, in the
+        format of the collection (JSON lines).
+        """
+        with self._lock:
+            keys = select_keys(params, self._keys, self._get_ts)
+            return '\n'.join(self._read(key) for key in keys)
+
+    def post(self, data):
+        """ Posts to the collection and applies the data to the mirror. """
+        response = self.collection.post(data)
+        with self._lock:
+            self._write(data if isinstance(data, list) else [data], False)
+        return response
+
+    def post_many(self, data, **kwargs):
+        """ Posts to the collection (see Collection.post_many) and applies
+        the data to the mirror.
+        """
+        data = list(data)
+        results = self.collection.post_many(data, **kwargs)
+        with self._lock:
+            self._write(data, False)
+        return results
+
+    def delete(self, key):
+        """ Deletes from the collection and the mirror. """
+        response = self.collection.delete(key)
+        self._remove([key])
+        return response
+
+    def delete_many(self, keys, **kwargs):
+        """ Deletes from the collection (see Collection.delete_many) and the
+        mirror.
+        """
+        keys = list(keys)
+        results = self.collection.delete_many(keys, **kwargs)
+        self._remove(keys)
+        return results
+
+    def _remove(self, keys):
+        with self._lock:
+            for key in keys:
+                entry = self._index.pop(key, None)
+                if entry is not None:
+                    self._keys.discard(key)
+                    self._live -= entry[1] + 1
+            self._compact_if_stale()
+
+    def close(self):
+        """ Saves the index and releases the data file. """
+        with self._lock:
+            self._save()
+            self._close_map()
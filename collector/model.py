@@ -1,25 +1,99 @@
 import logging
+import time
 from abc import ABCMeta
 from itertools import chain
 from collections import MutableMapping
-from collector.field import Field
-from collector.query import QueryApiMixin
-from collector.query_result import QueryResult
-from collector.utils import flatten
+from collector.field import Field, FieldDescriptor
+from collector.query import (QueryApiMixin, LimitQuery, PageSizeQuery,
+                             PageQuery, OnlyQuery, optimize_params,
+                             split_params)
+from collector.query_result import (QueryResult, PaginatedQueryResult,
+                                    MergedResult)
+from collector.utils import flatten, project, record_type
+from collector.scan import ParallelScan
+from collector.watch import Watcher
 
 
 class ModelMeta(ABCMeta):
     def __new__(cls, name, bases, attrs):
         obj = super(ModelMeta, cls).__new__(cls, name, bases, attrs)
         field_names = []
-        for name, attr in obj.__dict__.items():
+        for attr_name, attr in obj.__dict__.items():
             if isinstance(attr, Field):
-                field_names.append(name)
-                attr.add_to_class(obj, name)
+                field_names.append(attr_name)
+                attr.add_to_class(obj, attr_name)
         setattr(obj, '_field_names', field_names)
+        setattr(obj, '_field_set', frozenset(field_names))
+        # Whether all fields store their values in the instance dict, as
+        # FieldDescriptor does, so that they could be accessed directly.
+        setattr(obj, '_plain_fields', all(
+            type(obj.__dict__.get(field_name)) is FieldDescriptor
+            for field_name in field_names))
+        setattr(obj, '_warned_fields', set())
+        # Compact record class which is used by QueryResult.tuples().
+        setattr(obj, '_record_cls', record_type(
+            name + 'Record', ['_key', '_ts'] + field_names))
+        setattr(obj, '_hydrate', staticmethod(_build_hydrator(obj)))
         return obj
 
 
+def _build_hydrator(model_cls):
+    """ Builds the function which creates a clean model instance of given
+    class from fetched data, as Model.create followed by Model._mark_clean
+    would, but without calling the constructor, descriptors and change
+    tracking per field. Models which customize the construction (override
+    __init__, create or _update_fields) or the fields are created by
+    Model.create.
+    """
+    field_names = model_cls._field_names
+    field_set = model_cls._field_set
+    new = object.__new__
+
+    def hydrate_generic(prototype, data):
+        model = prototype.create(**data)
+        model._mark_clean()
+        return model
+
+    if not model_cls._plain_fields or _overrides_construction(model_cls):
+        return hydrate_generic
+
+    def hydrate(prototype, data):
+        model = new(model_cls)
+        fields = dict.fromkeys(field_names)
+        key = ts = None
+        for name, val in data.iteritems():
+            if name in field_set:
+                fields[name] = val
+            elif name == '_key':
+                key = val
+            elif name == '_ts':
+                ts = val
+            else:
+                prototype._warn_missing_field(name)
+        attrs = model.__dict__
+        attrs.update(fields)
+        attrs.update(collection=prototype.collection, model=model,
+                     _logname=prototype._logname,
+                     logger=logging.getLogger(prototype._logname),
+                     _key=key, _ts=ts, _Model__key=key, _Model__ts=ts,
+                     _snapshot=fields.copy(), _changed=set())
+        if prototype.identity_map is not None:
+            attrs['identity_map'] = prototype.identity_map
+        return model
+
+    return hydrate
+
+
+def _overrides_construction(model_cls):
+    # The base model (Model) is the last class of the MRO which is created by
+    # ModelMeta, the classes before it may override its methods.
+    mro = model_cls.__mro__
+    base_index = max(index for index, cls in enumerate(mro)
+                     if isinstance(cls, ModelMeta))
+    return any(name in cls.__dict__ for cls in mro[:base_index]
+               for name in ['__init__', 'create', '_update_fields'])
+
+
 class Model(MutableMapping, QueryApiMixin):
     """ Main class which is supposed to be a base class for every model
     definition.
@@ -34,11 +108,23 @@ class Model(MutableMapping, QueryApiMixin):
     Attributes:
     _key: Could be used as an identifier of the particular data
     _ts: Timestamp in milliseconds when the data is added to collections.
+    identity_map: IdentityMap instance (optional). If set, query results
+    return the same instance for the same _key, which is refreshed only if
+    its _ts changes. It is passed to the instances created by this one.
+
+    Class attributes:
+    default_page_size: Number of entries per page which is used by
+    iter_pages() when page size is not given by the query.
 
     """
     __metaclass__ = ModelMeta
     _field_names = []
     _extra_http_queries = [('meta', '_key'), ('meta', '_ts')]
+    default_page_size = 1000
+    # Whether the instance lacks fields which are excluded by only().
+    _partial = False
+    identity_map = None
+    _snapshot = None
     __key = None
     __ts = None
 
@@ -82,7 +168,79 @@ class Model(MutableMapping, QueryApiMixin):
          In given example, foo and bar Field() attributes of the model, will be
          assigned to foo_val2 and bar_val2 values respectively.
         """
-        return type(self)(self.collection, self._logname, *a, **kw)
+        model = type(self)(self.collection, self._logname, *a, **kw)
+        if self.identity_map is not None:
+            model.identity_map = self.identity_map
+        return model
+
+    def _refresh(self, data):
+        """ Replaces the fields and _ts with the ones in given data. """
+        for name in self._field_names:
+            setattr(self, name, None)
+        self._update_fields(data)
+        self.__dict__['_ts'] = self._ts
+
+    @property
+    def is_dirty(self):
+        """ Whether any field is changed since the data is fetched from (or
+        saved to) the collection server. Instances which are not fetched from
+        the server are always dirty.
+        """
+        return self._snapshot is None or bool(self._changed)
+
+    @property
+    def changed_fields(self):
+        """ Set of names of the fields which are changed since the data is
+        fetched from (or saved to) the collection server. For instances which
+        are not fetched from the server, all fields which have a value.
+        """
+        if self._snapshot is None:
+            return set(name for name in self._field_names
+                       if getattr(self, name) is not None)
+        return set(self._changed)
+
+    def mark_changed(self, *names):
+        """ Marks given fields as changed. Changes made in place to mutable
+        values (such as appending to a list) are not tracked, hence they should
+        be marked explicitly.
+        """
+        if self._snapshot is not None:
+            self._changed.update(names)
+
+    def _track_change(self, name, value):
+        snapshot = self._snapshot
+        if snapshot is None:
+            return
+        if snapshot.get(name) == value:
+            self._changed.discard(name)
+        else:
+            self._changed.add(name)
+
+    def _mark_clean(self):
+        self.__dict__['_snapshot'] = dict(
+            (name, getattr(self, name)) for name in self._field_names)
+        self.__dict__['_changed'] = set()
+
+    def _check_complete(self):
+        if self._partial:
+            raise RuntimeError(
+                'Instance %s is partial (fetched by only()), saving it would '
+                'drop the fields which are not fetched.' % self._key)
+
+    def _saved_callback(self):
+        """ Returns a function which marks the current values of the fields
+        as saved, so that the fields which are changed later stay dirty.
+        """
+        snapshot = dict((name, getattr(self, name))
+                        for name in self._field_names)
+
+        def saved():
+            self.__dict__['_snapshot'] = snapshot
+            self.__dict__['_changed'] = set(
+                name for name in self._field_names
+                if getattr(self, name) != snapshot[name])
+
+        return saved
 
     def delete(self):
         """ Removes the data from the collection.
@@ -90,6 +248,13 @@ class Model(MutableMapping, QueryApiMixin):
         Raises an exception if operation fails.
         """
         self.collection.delete(self._key)
+        if self.identity_map is not None:
+            self.identity_map.remove(self)
+
+    def _delete_query(self, query):
+        result = self.execute(query)
+        keys = [data.get('_key') for data in result._iter_data()]
+        return self.collection.delete_many(keys)
 
     @staticmethod
     def _sort_chain(qchain):
@@ -100,33 +265,210 @@ class Model(MutableMapping, QueryApiMixin):
         return reversed(query.get_chain())
 
     def _compile_query_chain(self, query_chain):
+        instrumentation = getattr(self.collection, 'instrumentation', None)
+        if instrumentation is not None:
+            start = time.time()
         query_chain_compiled = [query.compile() for query in query_chain]
         query_chain_compiled.append(self._extra_http_queries)
-        return flatten(query_chain_compiled)
+        params = optimize_params(flatten(query_chain_compiled))
+        if instrumentation is not None:
+            instrumentation.on_compile(params, time.time() - start)
+        return params
 
-    def execute(self, query=None):
+    def _request(self, params):
+        """ Requests the query parameters from the collection.
+
+        If the URL of the request would be longer than max_url_length of the
+        collection, the keys and prefixes are split into several requests
+        and a MergedResult of them is returned.
+        """
+        collection = self.collection
+        max_length = getattr(collection, 'max_url_length', None)
+        if max_length:
+            groups = split_params(params, max_length,
+                                  len(collection.endpoint) + 1)
+            if len(groups) > 1:
+                counts = [value for name, value in params if name == 'count']
+                return MergedResult([collection.request(group)
+                                     for group in groups],
+                                    counts[-1] if counts else None)
+        return collection.request(params)
+
+    def _iterate_result(self, result):
+        """ Returns the iterator of the collection over the result. """
+        if isinstance(result, MergedResult):
+            return result.merge(self._iterate_result)
+        collection = self.collection
+        instrumentation = getattr(collection, 'instrumentation', None)
+        if instrumentation is None:
+            return collection.iterator_cls(result)
+        return collection.iterator_cls(result, instrumentation=instrumentation)
+
+    def execute(self, query=None, raw=False):
         """ Takes optional query parameter as an input and returns query result.
 
          If query parameter is not given, then all data available in the
          collection server, should be returned.
 
+         If raw is True, the result yields decoded data (dicts) as they are,
+         instead of model instances.
+
+         If the query has page_size(), the result is fetched lazily page by
+         page (see iter_pages()).
+
          Raises an exception if operation fails, returns QueryResult otherwise.
          """
         qchain = self._get_chain(query) if query else []
         qchain = self._sort_chain(qchain)
+        page_size = self._get_page_size(qchain)
+        if page_size:
+            return self._execute_paginated(qchain, page_size, raw=raw)
         params = self._compile_query_chain(qchain)
-        result = self.collection.request(params)
-        return QueryResult(model=self, result=result)
+        result = self._request(params)
+        return QueryResult(model=self, result=result, raw=raw,
+                           projection=self._get_projection(qchain))
+
+    def iter_pages(self, query=None, raw=False):
+        """ Executes the query page by page and returns an iterator over
+        pages, every page is a list of model instances (or data, if raw is
+        True).
+
+        Pages are requested with count/startafter parameters, hence the page
+        size (default_page_size, unless set by page_size() query) bounds the
+        number of entries held in memory at once.
+        """
+        qchain = self._get_chain(query) if query else []
+        qchain = self._sort_chain(qchain)
+        page_size = self._get_page_size(qchain) or self.default_page_size
+        return self._execute_paginated(qchain, page_size, raw=raw).pages()
 
-    def save(self):
-        """ Submits all variables of the data (declared as Field),
-        regardless of any change, to the collection server.
+    def watch(self, query=None, **kwargs):
+        """ Returns an endless iterator which yields the model instances (or
+        data, if raw=True is given) which are created or updated since the
+        last poll of the query, see Watcher for the parameters.
+
+        Example:
+        for foo in fm.prefix('fo').watch(checkpoint=FileCheckpoint(path)):
+            process(foo)
+        """
+        return Watcher(self, query, **kwargs)
+
+    def parallel_scan(self, query=None, **kwargs):
+        """ Returns a ParallelScan of the query, which partitions the
+        keyspace by key prefixes or _ts ranges into shards and fetches them
+        concurrently, see ParallelScan for the parameters.
+
+        Example:
+        for foo in fm.parallel_scan(shards=16, prefixes=list('0123456789')):
+            process(foo)
+        """
+        return ParallelScan(self, query, **kwargs)
+
+    @staticmethod
+    def _get_page_size(qchain):
+        for query in qchain:
+            if isinstance(query, PageSizeQuery):
+                return query.size
+
+    @staticmethod
+    def _get_projection(qchain):
+        queries = [query for query in qchain if isinstance(query, OnlyQuery)]
+        if queries:
+            return frozenset(['_key', '_ts'] +
+                             [field for query in queries
+                              for field in query.fields])
+
+    @staticmethod
+    def _get_limit(qchain):
+        for query in qchain:
+            if isinstance(query, LimitQuery):
+                return query.count
+
+    def _execute_paginated(self, qchain, page_size, raw=False):
+        limit = self._get_limit(qchain)
+        qchain = [query for query in qchain
+                  if not isinstance(query, (LimitQuery, PageSizeQuery))]
+        projection = self._get_projection(qchain)
+        pages = self._fetch_pages(qchain, page_size, limit, projection)
+        return PaginatedQueryResult(model=self, result=pages, raw=raw,
+                                    projection=projection)
+
+    def _fetch_pages(self, qchain, page_size, limit=None, projection=None):
+        startafter = None
+        remaining = limit
+        while remaining is None or remaining > 0:
+            count = page_size if remaining is None else min(page_size,
+                                                            remaining)
+            page_query = PageQuery(self, count, startafter=startafter)
+            params = self._compile_query_chain(qchain + [page_query])
+            result = self._request(params)
+            page = list(self._iterate_result(result))
+            if projection is not None:
+                page = [project(data, projection) for data in page]
+            if page:
+                yield page
+            if len(page) < count:
+                break
+            startafter = page[-1].get('_key')
+            if remaining is not None:
+                remaining -= len(page)
+
+    def save(self, force=False):
+        """ Submits all variables of the data (declared as Field) to the
+        collection server, if any of them is changed (see is_dirty) or force
+        is True.
+
+        Returns whether the data is submitted.
+
+        Raises RuntimeError, if the instance is partial (fetched by a query
+        with only() which excludes some of the fields), as saving it would
+        drop the excluded fields.
 
          Raises an exception, if operation fails.
         """
+        self._check_complete()
+        if not force and not self.is_dirty:
+            return False
+        buffer = getattr(self.collection, 'write_buffer', None)
+        if buffer is not None:
+            # The data is only queued, it is clean once it is written.
+            buffer.add(self._get_save_data(), self._saved_callback())
+            return True
+        self.collection.post(self._get_save_data())
+        self._mark_clean()
+        return True
+
+    def save_many(self, models, force=False, **kwargs):
+        """ Submits given model instances which are changed (all of them if
+        force is True) to the collection server in batches, see
+        Collection.post_many for the keyword arguments.
+
+        Returns the list of per request results, which is empty in
+        write-behind mode, as the data is only queued (see
+        Collection.write_behind).
+
+        Raises RuntimeError, if any of the instances is partial (see save),
+        or BulkWriteError, if a request fails.
+        """
+        models = list(models)
+        for model in models:
+            model._check_complete()
+        models = [model for model in models if force or model.is_dirty]
+        buffer = getattr(self.collection, 'write_buffer', None)
+        if buffer is not None:
+            for model in models:
+                buffer.add(model._get_save_data(), model._saved_callback())
+            return []
+        data = (model._get_save_data() for model in models)
+        results = self.collection.post_many(data, **kwargs)
+        for model in models:
+            model._mark_clean()
+        return results
+
+    def _get_save_data(self):
         updated_data = {'_key': self._key}
         updated_data.update(self._get_fields())
-        self.collection.post(updated_data)
+        return updated_data
 
     def _update_fields(self, data):
         for key, val in data.items():
@@ -139,11 +481,21 @@ class Model(MutableMapping, QueryApiMixin):
                 elif key == '_ts':
                     self.__ts = val
                 else:
-                    self.logger.warn('Missing Field declaration: %s.' % key)
+                    self._warn_missing_field(key)
+
+    def _warn_missing_field(self, key):
+        # Warn once per field of the class, not for every instance.
+        if key not in self._warned_fields:
+            self._warned_fields.add(key)
+            self.logger.warn('Missing Field declaration: %s.' % key)
 
     def _get_fields(self):
         filtered_fields = {}
-        fields = {name:  getattr(self, name) for name in self._field_names}
+        if self._plain_fields:
+            get = self.__dict__.get
+            fields = {name: get(name) for name in self._field_names}
+        else:
+            fields = {name: getattr(self, name) for name in self._field_names}
         internal_vars = [('_key', self._key), ('_ts', self._ts)]
         for key, val in chain(fields.items(), internal_vars):
             if val is not None:
@@ -151,7 +503,7 @@ class Model(MutableMapping, QueryApiMixin):
         return filtered_fields
 
     def _is_field(self, item):
-        return item in self._field_names
+        return item in self._field_set
 
     def __getitem__(self, item):
         if self._is_field(item):
@@ -1,3 +1,90 @@
+from multiprocessing.pool import ThreadPool
+from urllib import urlencode
+
+# Parameters which select the data, the result is the union of them.
+_SELECTORS = ('key', 'prefix')
+
+
+def execute_many(queries, max_workers=8, prefetch=True):
+    """ Executes given queries concurrently and yields (query, QueryResult)
+    pairs in the order they complete.
+
+    Queries could be Query or Model instances (possibly bound to different
+    collections), they are run on a thread pool of max_workers threads. The
+    queries of the same collection share its connection.
+
+    Parameters:
+    queries: Iterable of queries.
+    max_workers: Maximum number of queries running at once.
+    prefetch: Whether the results are read completely by the workers. If
+    False, only the response headers are awaited concurrently and the body of
+    every result is read while it is being iterated.
+
+    Raises the exception of the first failing query.
+    """
+    def execute(query):
+        result = query.execute()
+        if prefetch:
+            result.prefetch()
+        return query, result
+
+    pool = ThreadPool(max_workers)
+    try:
+        for query, result in pool.imap_unordered(execute, queries):
+            yield query, result
+    finally:
+        pool.terminate()
+
+
+def optimize_params(params):
+    """ Returns compiled query parameters without duplicate keys and
+    prefixes. Unless prefixcount is given (which limits the data per prefix),
+    keys and prefixes which are covered by another prefix are dropped too.
+    """
+    prefixes = set(value for name, value in params if name == 'prefix')
+    if any(name == 'prefixcount' for name, _ in params):
+        prefixes = set()
+
+    def is_covered(name, value):
+        # A prefix covers the keys and the longer prefixes starting with it.
+        end = len(value) + 1 if name == 'key' else len(value)
+        return any(value[:i] in prefixes for i in range(end))
+
+    seen = set()
+    result = []
+    for name, value in params:
+        if name in _SELECTORS:
+            if (name, value) in seen or is_covered(name, value):
+                continue
+            seen.add((name, value))
+        result.append((name, value))
+    return result
+
+
+def split_params(params, max_length, base_length=0):
+    """ Splits compiled query parameters into groups whose urlencoded
+    length (plus base_length) is at most max_length, by distributing the keys
+    and prefixes between them, and returns the list of groups. Every group
+    has the other parameters as they are.
+    """
+    selectors = [param for param in params if param[0] in _SELECTORS]
+    if (len(selectors) < 2
+            or base_length + len(urlencode(params)) <= max_length):
+        return [params]
+    others = [param for param in params if param[0] not in _SELECTORS]
+    budget = max_length - base_length - len(urlencode(others)) - 1
+    groups, group, size = [], [], 0
+    for param in selectors:
+        length = len(urlencode([param])) + 1
+        if group and size + length > budget:
+            groups.append(group)
+            group, size = [], 0
+        group.append(param)
+        size += length
+    groups.append(group)
+    return [group + others for group in groups]
+
+
 class QueryApiMixin(object):
     """ The mixin which should be used if the class needs to support
     querying collection.
@@ -25,6 +112,14 @@ class QueryApiMixin(object):
     def prefix(self, *args, **kwargs):
         return self._create_query(PrefixQuery, *args, **kwargs)
 
+    def limit(self, *args, **kwargs):
+        return self._create_query(LimitQuery, *args, **kwargs)
+
+    def page_size(self, *args, **kwargs):
+        return self._create_query(PageSizeQuery, *args, **kwargs)
+
+    def only(self, *args, **kwargs):
+        return self._create_query(OnlyQuery, *args, **kwargs)
 
 
 class Query(QueryApiMixin):
@@ -56,8 +151,27 @@ class Query(QueryApiMixin):
             prev = prev.prev
         return res
 
-    def execute(self):
-        return self.model.execute(self)
+    def execute(self, raw=False):
+        return self.model.execute(self, raw=raw)
+
+    def iter_pages(self, raw=False):
+        return self.model.iter_pages(self, raw=raw)
+
+    def watch(self, **kwargs):
+        return self.model.watch(self, **kwargs)
+
+    def parallel_scan(self, **kwargs):
+        return self.model.parallel_scan(self, **kwargs)
+
+    def delete(self):
+        """ Deletes all data which matches the query from the collection, in
+        batched requests.
+
+        Returns the list of per request results.
+
+        Raises BulkWriteError, if a request fails.
+        """
+        return self.model._delete_query(self)
 
 
 class SelectQuery(Query):
@@ -106,3 +220,70 @@ class PrefixQuery(Query):
             _ = int(prefixcount)
             res.append(('prefixcount', prefixcount))
         return res
+
+
+class LimitQuery(Query):
+    """ Query class which is returned by limit() function. """
+    def __init__(self, model, count, **kwargs):
+        super(LimitQuery, self).__init__(model, **kwargs)
+        self.count = int(count)
+        self.priority = 3
+
+    def compile(self):
+        return [('count', self.count)]
+
+
+class PageSizeQuery(Query):
+    """ Query class which is returned by page_size() function.
+
+    It does not add any parameter by itself, instead it makes the model
+    fetch the result page by page, each page having at most given number of
+    entries.
+    """
+    def __init__(self, model, size, **kwargs):
+        super(PageSizeQuery, self).__init__(model, **kwargs)
+        self.size = int(size)
+        if self.size < 1:
+            raise ValueError('Page size must be positive: %s' % size)
+        self.priority = 3
+
+    def compile(self):
+        return []
+
+
+class PageQuery(Query):
+    """ Query class which is used internally to request a single page, which
+    starts after the given key.
+    """
+    def __init__(self, model, count, startafter=None, **kwargs):
+        super(PageQuery, self).__init__(model, **kwargs)
+        self.count = count
+        self.startafter = startafter
+        self.priority = 4
+
+    def compile(self):
+        res = []
+        if self.startafter is not None:
+            res.append(('startafter', self.startafter))
+        res.append(('count', self.count))
+        return res
+
+
+class OnlyQuery(Query):
+    """ Query class which is returned by only() function.
+
+    Restricts the data to _key, _ts and given fields (or the declared fields
+    of the model, if none is given). Other fields are dropped as soon as the
+    data is decoded. If the collection has projection_param, the fields are
+    requested from the server by that parameter as well.
+    """
+    def __init__(self, model, *args, **kwargs):
+        super(OnlyQuery, self).__init__(model, *args, **kwargs)
+        self.fields = args or tuple(model._field_names)
+        self.priority = 3
+
+    def compile(self):
+        param = getattr(self.model.collection, 'projection_param', None)
+        if not param:
+            return []
+        return [(param, field) for field in self.fields]
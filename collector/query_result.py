@@ -1,25 +1,184 @@
+import heapq
+import time
+from itertools import chain
+from collector.columns import to_columns
 from collector.exceptions import NoSuchElement
+from collector.utils import project
+
+
+class MergedResult(object):
+    """ Results of the requests a query is split into, see
+    Model._request.
+
+    The results are merged in _key order (as every result is ordered by
+    _key), data of the same _key is yielded once and at most count data is
+    yielded, if count is given.
+    """
+    def __init__(self, results, count=None):
+        self.results = results
+        self.count = count
+
+    def merge(self, iterate):
+        """ Returns an iterator over the merged data, given the function
+        which returns an iterator over the data of a single result.
+        """
+        iterators = [_decorate(index, iterate(result))
+                     for index, result in enumerate(self.results)]
+        last_key = None
+        remaining = self.count
+        for key, _, data in heapq.merge(*iterators):
+            if key is not None and key == last_key:
+                continue
+            if remaining is not None:
+                if remaining <= 0:
+                    break
+                remaining -= 1
+            last_key = key
+            yield data
+
+    def close(self):
+        for result in self.results:
+            close = getattr(result, 'close', None)
+            if close is not None:
+                close()
+
+
+def _decorate(index, data):
+    # Index of the result keeps the order of data with the same key.
+    for item in data:
+        yield item.get('_key'), index, item
 
 
 class QueryResult(object):
     """ Contains data from collection database as a result of query execution.
 
     This class is Iterable and uses collection's iterator class to process
-    the result.
+    the result. The result may be streamed from the collection database, in
+    which case it could be iterated only once (see prefetch()).
+
+    If raw is True, decoded data (dicts) are yielded as they are, instead of
+    model instances. See also values() and tuples().
+
+    If projection (set of names) is given, the other fields of the data are
+    dropped right after decoding. Model instances which lack declared fields
+    due to the projection are partial, they could not be saved.
     """
-    def __init__(self, model, result):
+    def __init__(self, model, result, raw=False, projection=None):
         self.model = model
         self.result = result
+        self.raw = raw
+        self.projection = projection
+        self._partial = (projection is not None and
+                         not model._field_set <= projection)
+        self._data = None
 
-    def __iter__(self):
-        collection = self.model.collection
-        for data in collection.iterator_cls(self.result):
+    def _read_data(self):
+        data = iter(self.model._iterate_result(self.result))
+        if self.projection is None:
+            return data
+        return (project(item, self.projection) for item in data)
+
+    def _iter_data(self):
+        if self._data is not None:
+            return iter(self._data)
+        return self._read_data()
+
+    def _create_model(self, data):
+        identity_map = self.model.identity_map
+        key = data.get('_key')
+        if identity_map is None or key is None:
             # Create a new model instance
-            model = self.model.create(**data)
-            yield model
+            return self._hydrate(data)
+        model = identity_map.get(type(self.model), self.model.collection,
+                                 key)
+        if model is None:
+            model = identity_map.add(self._hydrate(data))
+        elif (model._ts != data.get('_ts') or
+              model._partial and not self._partial):
+            model._refresh(data)
+            model._mark_clean()
+            model.__dict__['_partial'] = self._partial
+        return model
+
+    def _hydrate(self, data):
+        model = self.model._hydrate(self.model, data)
+        if self._partial:
+            model.__dict__['_partial'] = True
+        return model
+
+    def __iter__(self):
+        if self.raw:
+            return self._iter_data()
+        return self._iter_models()
+
+    def _iter_models(self):
+        instrumentation = getattr(self.model.collection, 'instrumentation',
+                                  None)
+        if instrumentation is not None:
+            return self._iter_models_measured(instrumentation)
+        return (self._create_model(data) for data in self._iter_data())
+
+    def _iter_models_measured(self, instrumentation):
+        rows, seconds = 0, 0.0
+        try:
+            for data in self._iter_data():
+                start = time.time()
+                model = self._create_model(data)
+                seconds += time.time() - start
+                rows += 1
+                yield model
+        finally:
+            instrumentation.on_hydrate(rows, seconds)
+
+    def values(self):
+        """ Returns an iterator over dicts which contain _key, _ts and the
+        declared fields of the data, without creating model instances.
+        """
+        names = self.model._record_cls._fields
+        for data in self._iter_data():
+            yield project(data, names)
+
+    def tuples(self):
+        """ Returns an iterator over compact records (tuples) of _key, _ts
+        and the declared fields of the data (missing ones are None), which
+        could be accessed as attributes, without creating model instances.
+        """
+        record_cls = self.model._record_cls
+        names = record_cls._fields
+        for data in self._iter_data():
+            yield record_cls(map(data.get, names))
+
+    def to_columns(self, fields=None):
+        """ Reads the result into columns without creating model instances,
+        returns a dict of field name to numpy masked array (see
+        collector.columns.to_columns).
+
+        Parameters:
+        fields: Names of the fields, defaults to _key, _ts and the declared
+        fields of the model.
+
+        Raises RuntimeError if numpy is not installed.
+        """
+        fields = fields or self.model._record_cls._fields
+        return to_columns(self._iter_data(), fields)
+
+    def prefetch(self):
+        """ Reads the whole result into memory and returns self. Afterwards
+        the result could be iterated multiple times.
+        """
+        if self._data is None:
+            self._data = list(self._read_data())
+        return self
+
+    def close(self):
+        """ Releases the underlying connection if the result is streamed. """
+        close = getattr(self.result, 'close', None)
+        if close is not None:
+            close()
 
     def first(self):
-        """ Returns first data of the result.
+        """ Returns first data of the result and closes the result, the rest
+        of the data is not read.
 
         Raises NoSuchElement if query returns empty result.
         """
@@ -27,6 +186,8 @@ class QueryResult(object):
             return next(iter(self))
         except StopIteration:
             raise NoSuchElement
+        finally:
+            self.close()
 
     def all(self):
         """ Returns list of all result. Normally the iteration is lazy, this
@@ -35,3 +196,24 @@ class QueryResult(object):
          Equivalent of list(iter(query_result))
         """
         return list(iter(self))
+
+
+class PaginatedQueryResult(QueryResult):
+    """ Query result which is fetched page by page.
+
+    The result is a lazy iterable of pages, where every page is a list of
+    data (which is already projected). The next page is requested only after
+    the previous one is consumed.
+    """
+    def _read_data(self):
+        return chain.from_iterable(self.result)
+
+    def pages(self):
+        """ Returns an iterator over pages, every page is a list of model
+        instances (or data, if the result is raw).
+        """
+        for page in self.result:
+            if self.raw:
+                yield page
+            else:
+                yield [self._create_model(data) for data in page]
@@ -0,0 +1,188 @@
+import time
+from multiprocessing.pool import ThreadPool
+from Queue import Queue, Full
+from threading import Event
+from collector.query import (LimitQuery, PageQuery, PageSizeQuery,
+                             PrefixQuery, WhenQuery)
+from collector.query_result import PaginatedQueryResult
+from collector.utils import project
+
+# Marks the end of a shard in the queue of pages.
+_DONE = object()
+
+
+class ParallelScan(object):
+    """ Scans a query in shards which are fetched concurrently, see
+    Model.parallel_scan().
+
+    The keyspace is partitioned either by given key prefixes (which are
+    distributed between the shards) or by splitting the _ts range from
+    startts to endts into equal when() ranges. Every shard is fetched page
+    by page, a failing page request is retried (after retry_delay seconds,
+    doubled on every attempt) up to retries times, starting after the last
+    key of the previous page, so the other shards and the fetched pages of
+    the shard are not fetched again.
+
+    Iterating the scan runs the shards on a pool of max_workers threads and
+    yields the data of all shards as it arrives (in no particular order).
+    Alternatively, shards() returns an iterable per shard, which fetches the
+    shard in the thread consuming it.
+
+    Parameters:
+    model: Model instance.
+    query: Query to scan (optional), limit() is ignored, page_size() gives
+    the page size and when() gives the _ts range, if prefixes are not given.
+    shards: Number of shards.
+    prefixes: Key prefixes to partition the keyspace by (optional).
+    startts, endts: _ts range to partition, if prefixes are not given.
+    max_workers: Number of threads fetching shards, defaults to shards.
+    page_size: Number of entries per request, defaults to the page size of
+    the query or default_page_size of the model.
+    retries: Number of retries of a failing request.
+    retry_delay: Time to wait in seconds before the first retry.
+    raw: Whether to yield decoded data instead of model instances.
+    sleep: Function which is used to wait.
+
+    Raises ValueError if neither prefixes nor the _ts range is given, or if
+    prefixes are given for a query which has prefix() already.
+    """
+    # Size of the queue of pages, per worker.
+    queue_size = 2
+
+    def __init__(self, model, query=None, shards=8, prefixes=None,
+                 startts=None, endts=None, max_workers=None, page_size=None,
+                 retries=3, retry_delay=1.0, raw=False, sleep=time.sleep):
+        qchain = model._get_chain(query) if query else []
+        qchain = model._sort_chain(qchain)
+        self.model = model
+        self.page_size = (page_size or model._get_page_size(qchain)
+                          or model.default_page_size)
+        self.retries = retries
+        self.retry_delay = retry_delay
+        self.raw = raw
+        self.sleep = sleep
+        self._projection = model._get_projection(qchain)
+        qchain = [query for query in qchain
+                  if not isinstance(query, (LimitQuery, PageSizeQuery))]
+        if prefixes:
+            if any(isinstance(query, PrefixQuery) for query in qchain):
+                raise ValueError('Prefixes could not be given for a query '
+                                 'which has prefix().')
+            shards = min(shards, len(prefixes))
+            self._shards = [qchain + [PrefixQuery(model, *prefixes[i::shards])]
+                            for i in range(shards)]
+        else:
+            for query in qchain:
+                if isinstance(query, WhenQuery):
+                    if startts is None:
+                        startts = query.startts
+                    if endts is None:
+                        endts = query.endts
+            if startts is None or endts is None:
+                raise ValueError('Either prefixes or startts and endts are '
+                                 'required to partition the scan.')
+            qchain = [query for query in qchain
+                      if not isinstance(query, WhenQuery)]
+            self._shards = [qchain + [WhenQuery(model, startts=start,
+                                                endts=end)]
+                            for start, end in _split_range(startts, endts,
+                                                           shards)]
+        self.max_workers = max_workers or len(self._shards)
+
+    def __len__(self):
+        return len(self._shards)
+
+    def _fetch_shard(self, qchain):
+        """ Yields the pages of a shard, retrying failing requests. """
+        model = self.model
+        startafter = None
+        failures = 0
+        while True:
+            page_query = PageQuery(model, self.page_size,
+                                   startafter=startafter)
+            params = model._compile_query_chain(
+                model._sort_chain(qchain + [page_query]))
+            try:
+                page = list(model._iterate_result(model._request(params)))
+            except Exception as e:
+                failures += 1
+                if failures > self.retries:
+                    raise
+                model.logger.warning('Retrying a page of the scan (%s).', e)
+                self.sleep(self.retry_delay * 2 ** (failures - 1))
+                continue
+            failures = 0
+            if self._projection is not None:
+                page = [project(data, self._projection) for data in page]
+            if page:
+                yield page
+            if len(page) < self.page_size:
+                return
+            startafter = page[-1].get('_key')
+
+    def _result(self, pages):
+        return PaginatedQueryResult(model=self.model, result=pages,
+                                    raw=self.raw, projection=self._projection)
+
+    def shards(self):
+        """ Returns the list of lazy results (PaginatedQueryResult) of the
+        shards.
+        """
+        return [self._result(self._fetch_shard(qchain))
+                for qchain in self._shards]
+
+    def __iter__(self):
+        return iter(self._result(self._iter_pages()))
+
+    def pages(self):
+        """ Returns an iterator over the pages of all shards, as they are
+        fetched.
+        """
+        return self._result(self._iter_pages()).pages()
+
+    def _iter_pages(self):
+        queue = Queue(self.queue_size * self.max_workers)
+        stopped = Event()
+
+        def put(item):
+            while not stopped.is_set():
+                try:
+                    queue.put(item, timeout=0.1)
+                    return
+                except Full:
+                    pass
+
+        def fetch(qchain):
+            try:
+                for page in self._fetch_shard(qchain):
+                    if stopped.is_set():
+                        return
+                    put(page)
+                put(_DONE)
+            except Exception as e:
+                put(e)
+
+        pool = ThreadPool(self.max_workers)
+        try:
+            for qchain in self._shards:
+                pool.apply_async(fetch, (qchain,))
+            remaining = len(self._shards)
+            while remaining:
+                item = queue.get()
+                if item is _DONE:
+                    remaining -= 1
+                elif isinstance(item, Exception):
+                    raise item
+                else:
+                    yield item
+        finally:
+            stopped.set()
+            pool.terminate()
+
+
+def _split_range(start, end, count):
+    """ Splits the inclusive range into at most count contiguous ranges. """
+    size = end - start + 1
+    count = max(min(count, size), 1)
+    bounds = [start + size * i // count for i in range(count + 1)]
+    return [(bounds[i], bounds[i + 1] - 1) for i in range(count)]
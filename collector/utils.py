@@ -1,6 +1,122 @@
 import itertools
+from bisect import bisect_left, bisect_right
+from operator import itemgetter
 
 
 def flatten(list_of_list):
     """ Takes list_of_list as an input, returns flat list """
     return list(itertools.chain(*list_of_list))
+
+
+def chunks(iterable, size):
+    """ Splits iterable into lists of at most given size """
+    iterator = iter(iterable)
+    while True:
+        chunk = list(itertools.islice(iterator, size))
+        if not chunk:
+            return
+        yield chunk
+
+
+def project(data, names):
+    """ Returns a dict of given names of data, missing names are skipped """
+    return dict((name, data[name]) for name in names if name in data)
+
+
+def record_type(name, fields):
+    """ Creates a compact tuple class whose items could be accessed as
+    attributes of given field names. Unlike namedtuple, field names may start
+    with an underscore.
+    """
+    def __new__(cls, values):
+        return tuple.__new__(cls, values)
+
+    def __repr__(self):
+        return '%s(%s)' % (name, ', '.join(
+            '%s=%r' % item for item in zip(fields, self)))
+
+    def _asdict(self):
+        return dict(zip(fields, self))
+
+    attrs = {'__slots__': (), '_fields': tuple(fields), '__new__': __new__,
+             '__repr__': __repr__, '_asdict': _asdict}
+    for index, field in enumerate(fields):
+        attrs[field] = property(itemgetter(index))
+    return type(name, (tuple,), attrs)
+
+
+class SortedKeys(object):
+    """ Set of keys which are iterated in order. The keys are kept in sorted
+    chunks of at most 2 * chunk_size keys, so adding or removing a key moves
+    the keys of a single chunk only, instead of sorting all of them again.
+    """
+    chunk_size = 512
+
+    def __init__(self, keys=()):
+        keys = sorted(set(keys))
+        size = self.chunk_size
+        self._chunks = [keys[i:i + size] for i in range(0, len(keys), size)]
+        self._maxes = [chunk[-1] for chunk in self._chunks]
+        self._len = len(keys)
+
+    def __len__(self):
+        return self._len
+
+    def __iter__(self):
+        return itertools.chain.from_iterable(self._chunks)
+
+    def __contains__(self, key):
+        index = bisect_left(self._maxes, key)
+        if index == len(self._chunks):
+            return False
+        chunk = self._chunks[index]
+        return chunk[bisect_left(chunk, key)] == key
+
+    def add(self, key):
+        if not self._chunks:
+            self._chunks.append([key])
+            self._maxes.append(key)
+            self._len += 1
+            return
+        index = min(bisect_left(self._maxes, key), len(self._chunks) - 1)
+        chunk = self._chunks[index]
+        position = bisect_left(chunk, key)
+        if position < len(chunk) and chunk[position] == key:
+            return
+        chunk.insert(position, key)
+        self._maxes[index] = chunk[-1]
+        self._len += 1
+        if len(chunk) > 2 * self.chunk_size:
+            half = len(chunk) // 2
+            self._chunks[index:index + 1] = [chunk[:half], chunk[half:]]
+            self._maxes[index:index + 1] = [chunk[half - 1], chunk[-1]]
+
+    def discard(self, key):
+        index = bisect_left(self._maxes, key)
+        if index == len(self._chunks):
+            return
+        chunk = self._chunks[index]
+        position = bisect_left(chunk, key)
+        if chunk[position] != key:
+            return
+        del chunk[position]
+        self._len -= 1
+        if chunk:
+            self._maxes[index] = chunk[-1]
+        else:
+            del self._chunks[index]
+            del self._maxes[index]
+
+    def iter_from(self, key, after=False):
+        """ Returns an iterator over the keys from given key on, or the keys
+        after it if after is True.
+        """
+        find = bisect_right if after else bisect_left
+        index = find(self._maxes, key)
+        if index == len(self._chunks):
+            return iter(())
+        chunk = self._chunks[index]
+        return itertools.chain(
+            itertools.islice(chunk, find(chunk, key), None),
+            itertools.chain.from_iterable(
+                itertools.islice(self._chunks, index + 1, None)))
@@ -0,0 +1,150 @@
+import json
+import os
+import time
+from collector.query import LimitQuery, PageSizeQuery, WhenQuery
+from collector.query_result import PaginatedQueryResult
+
+_MISSING = object()
+
+
+class FileCheckpoint(object):
+    """ Durable checkpoint of a Watcher, which is saved to a JSON file.
+
+    Parameters:
+    path: Path of the checkpoint file.
+
+    """
+    def __init__(self, path):
+        self.path = path
+
+    def load(self):
+        """ Returns the saved (_ts, keys) pair, or (None, []), see
+        Watcher.
+        """
+        if not os.path.exists(self.path):
+            return None, []
+        with open(self.path) as f:
+            state = json.load(f)
+        return state['ts'], state['keys']
+
+    def save(self, ts, keys):
+        tmp_path = self.path + '.tmp'
+        with open(tmp_path, 'w') as f:
+            json.dump({'ts': ts, 'keys': keys}, f)
+        os.rename(tmp_path, self.path)
+
+
+class Watcher(object):
+    """ Iterator which polls a query for the data written since the last
+    poll and yields it, see Model.watch().
+
+    Every poll requests the data having _ts greater than or equal to the
+    high-water mark, page by page in _key order. Data could be written during
+    a poll into the _key range which is already paged past, hence the mark
+    is only moved to the newest _ts of the first page of the poll (all the
+    data up to it is written before the poll starts). The data from the mark
+    on which is already yielded (the same _key and _ts) is skipped. Once the
+    data of a poll is consumed, the mark and the [_key, _ts] pairs yielded
+    from it on are saved to the checkpoint, hence the data is yielded at
+    least once even if the consumer stops in the middle of a poll.
+
+    When a poll returns nothing, the watcher sleeps before the next one,
+    doubling the interval up to max_interval. When a poll returns data, the
+    next poll is made right away.
+
+    Parameters:
+    model: Model instance.
+    query: Query to watch (optional), limit() is ignored and its when()
+    gives the initial startts and the endts.
+    poll_interval: Minimum time to wait in seconds after an empty poll.
+    max_interval: Maximum time to wait in seconds after an empty poll.
+    checkpoint: Object which has load() and save(ts, keys) methods, such as
+    FileCheckpoint (optional). If it is not given, the watch starts from
+    the initial startts (or the beginning) every time.
+    page_size: Number of entries per request, defaults to the page size of
+    the query or default_page_size of the model.
+    raw: Whether to yield decoded data instead of model instances.
+    sleep: Function which is used to wait.
+
+    Attributes:
+    ts: The high-water mark.
+    polls: Number of polls made.
+
+    """
+    def __init__(self, model, query=None, poll_interval=1.0, max_interval=30.0,
+                 checkpoint=None, page_size=None, raw=False, sleep=time.sleep):
+        qchain = model._get_chain(query) if query else []
+        qchain = model._sort_chain(qchain)
+        self.model = model
+        self.poll_interval = poll_interval
+        self.max_interval = max_interval
+        self.checkpoint = checkpoint
+        self.page_size = (page_size or model._get_page_size(qchain)
+                          or model.default_page_size)
+        self.raw = raw
+        self.sleep = sleep
+        self.polls = 0
+        self.ts, self.endts = None, None
+        for query in qchain:
+            if isinstance(query, WhenQuery):
+                self.ts, self.endts = query.startts, query.endts
+        self._qchain = [query for query in qchain if not isinstance(
+            query, (LimitQuery, PageSizeQuery, WhenQuery))]
+        self._projection = model._get_projection(qchain)
+        # _ts of the yielded data by _key, from the mark on.
+        self._seen = {}
+        if checkpoint is not None:
+            ts, keys = checkpoint.load()
+            if ts is not None:
+                # Checkpoints of earlier versions have the keys at the mark.
+                self.ts, self._seen = ts, dict(
+                    key if isinstance(key, list) else (key, ts)
+                    for key in keys)
+
+    def __iter__(self):
+        interval = self.poll_interval
+        while True:
+            found = False
+            for item in self.poll():
+                found = True
+                yield item
+            if found:
+                interval = self.poll_interval
+            else:
+                self.sleep(interval)
+                interval = min(interval * 2, self.max_interval)
+
+    def poll(self):
+        """ Makes a single poll and returns the lazy result, the checkpoint
+        is saved once the result is consumed.
+        """
+        self.polls += 1
+        when = WhenQuery(self.model, startts=self.ts, endts=self.endts)
+        qchain = self.model._sort_chain(self._qchain + [when])
+        pages = self.model._fetch_pages(qchain, self.page_size,
+                                        projection=self._projection)
+        return PaginatedQueryResult(model=self.model, result=self._track(pages),
+                                    raw=self.raw, projection=self._projection)
+
+    def _track(self, pages):
+        seen = self._seen
+        new_ts, new_seen = self.ts, dict(seen)
+        for index, page in enumerate(pages):
+            if index == 0:
+                page_ts = [data['_ts'] for data in page
+                           if data.get('_ts') is not None]
+                if page_ts and (new_ts is None or max(page_ts) > new_ts):
+                    new_ts = max(page_ts)
+            page = [data for data in page if data.get('_ts') is None or
+                    seen.get(data.get('_key'), _MISSING) != data['_ts']]
+            for data in page:
+                if data.get('_ts') is not None:
+                    new_seen[data.get('_key')] = data['_ts']
+            if page:
+                yield page
+        new_seen = dict((key, ts) for key, ts in new_seen.iteritems()
+                        if ts >= new_ts)
+        self.ts, self._seen = new_ts, new_seen
+        if self.checkpoint is not None and new_ts is not None:
+            self.checkpoint.save(new_ts, sorted(
+                [key, ts] for key, ts in new_seen.iteritems()))
@@ -1,4 +1,10 @@
+import gzip
 import itertools
+import zlib
+from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+from SocketServer import ThreadingMixIn
+from StringIO import StringIO
+from collector.collection import Collection
 from collector.model import Model
 from collector.field import Field
 from collector.iterators import JsonLinesIterator
@@ -38,6 +44,19 @@ class StubCollection(object):
         return [d for d in data for p in param
                 if d.get('_key', '').startswith(p)]
 
+    def _process_startafter(self, param, data):
+        return sorted([d for d in data if d.get('_key') > param[0]],
+                      key=lambda d: d.get('_key'))
+
+    def _process_startts(self, param, data):
+        return [d for d in data if d.get('_ts') >= param[0]]
+
+    def _process_endts(self, param, data):
+        return [d for d in data if d.get('_ts') <= param[0]]
+
+    def _process_count(self, param, data):
+        return sorted(data, key=lambda d: d.get('_key'))[:param[0]]
+
     def _process_data(self, params):
         res = self.data
         grouped = itertools.groupby(params, lambda x: x[0])
@@ -49,6 +68,7 @@ class StubCollection(object):
 
     def request(self, params=None):
         params = params or []
+        self.requests = getattr(self, 'requests', []) + [params]
         return self._process_data(params)
 
     def post(self, params=None):
@@ -65,9 +85,20 @@ class StubCollection(object):
             # Create new entry.
             self.data.append(params)
 
+    def post_many(self, data, **kwargs):
+        data = list(data)
+        for params in data:
+            self.post(params)
+        return [data]
+
     def delete(self, key):
         self.data = [d for d in self.data if d.get('_key') != key]
 
+    def delete_many(self, keys):
+        keys = list(keys)
+        self.data = [d for d in self.data if d.get('_key') not in keys]
+        return [keys]
+
 
 class FixedTestDataMixin(object):
     __test_data = [
@@ -92,3 +123,80 @@ class FixedTestDataMixin(object):
                 return fields
 
         return TestModel(collection=StubCollection(data=data))
+
+
+class FakeResponse(object):
+    def __init__(self, content):
+        self.content = content
+
+
+class FakeConnection(object):
+    """ Records the requests instead of sending them. """
+    def __init__(self, fail_after=None):
+        self.requests = []
+        self.posts = []
+        self.deletes = []
+        self.fail_after = fail_after
+
+    def request(self, url):
+        self.requests.append(url)
+        return FakeResponse('{"_key": "foo"}')
+
+    def post(self, url, data=None):
+        if self.fail_after is not None and len(self.posts) >= self.fail_after:
+            raise Exception('Server returned unhandled response code: 500')
+        self.posts.append((url, data))
+        return 'ok'
+
+    def delete(self, url):
+        if self.fail_after is not None and len(self.deletes) >= self.fail_after:
+            raise Exception('Server returned unhandled response code: 500')
+        self.deletes.append(url)
+        return 'ok'
+
+
+class CollectionTestMixin(object):
+    def _create_collection(self, cache=None, codec=None, **kwargs):
+        collection = Collection('1001', 'test', apikey='apikey', cache=cache,
+                                codec=codec)
+        collection.conn = FakeConnection(**kwargs)
+        return collection
+
+
+class GzipHandler(BaseHTTPRequestHandler):
+    """ Serves JSON lines, gzip compressed if accepted, and records posted
+    bodies.
+    """
+    body = '\n'.join('{"_key": "key%d", "value": "%s"}' % (i, 'x' * 100)
+                     for i in range(100))
+
+    def do_GET(self):
+        body = self.body
+        self.send_response(200)
+        if 'gzip' in self.headers.get('Accept-Encoding', ''):
+            sio = StringIO()
+            with gzip.GzipFile(fileobj=sio, mode='wb') as f:
+                f.write(body)
+            body = sio.getvalue()
+            self.send_header('Content-Encoding', 'gzip')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_POST(self):
+        body = self.rfile.read(int(self.headers['Content-Length']))
+        encoding = self.headers.get('Content-Encoding')
+        if encoding == 'gzip':
+            body = zlib.decompress(body, 16 + zlib.MAX_WBITS)
+        self.server.posts.append((encoding, body))
+        self.send_response(200)
+        self.send_header('Content-Length', '2')
+        self.end_headers()
+        self.wfile.write('ok')
+
+    def log_message(self, *args):
+        pass
+
+
+class ThreadingHTTPServer(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
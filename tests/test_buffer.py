@@ -0,0 +1,152 @@
+import threading
+import time
+from unittest import TestCase
+from collector.exceptions import WriteBehindError
+from collector.field import Field
+from collector.iterators import JsonLinesIterator
+from collector.model import Model
+from helpers import CollectionTestMixin
+
+
+class WriteBehindTest(TestCase, CollectionTestMixin):
+    def _posted_items(self, collection):
+        return [item for _, body in collection.conn.posts
+                for item in JsonLinesIterator(body)]
+
+    def test_coalesce(self):
+        collection = self._create_collection()
+        with collection.write_behind(interval=None):
+            collection.post({'_key': 'foo', 'value': 1})
+            collection.post({'_key': 'bar', 'value': 1})
+            collection.post({'_key': 'foo', 'value': 2})
+            collection.post({'value': 'no key'})
+            collection.post({'value': 'no key'})
+            self.assertEqual(collection.conn.posts, [])
+        self.assertIsNone(collection.write_buffer)
+        self.assertEqual(len(collection.conn.posts), 1)
+        self.assertEqual(self._posted_items(collection), [
+            {'_key': 'bar', 'value': 1}, {'_key': 'foo', 'value': 2},
+            {'value': 'no key'}, {'value': 'no key'}])
+
+    def test_max_items(self):
+        collection = self._create_collection()
+        with collection.write_behind(max_items=2, interval=None):
+            collection.post_many([{'_key': str(i)} for i in range(5)])
+            self.assertEqual(len(collection.conn.posts), 2)
+        self.assertEqual(len(collection.conn.posts), 3)
+        self.assertEqual(len(self._posted_items(collection)), 5)
+
+    def test_interval(self):
+        collection = self._create_collection()
+        buf = collection.write_behind(interval=0.01)
+        collection.post({'_key': 'foo'})
+        for _ in range(500):
+            if collection.conn.posts:
+                break
+            time.sleep(0.01)
+        self.assertEqual(self._posted_items(collection), [{'_key': 'foo'}])
+        buf.close()
+
+    def test_delete_discards_pending(self):
+        collection = self._create_collection()
+        with collection.write_behind(interval=None):
+            collection.post({'_key': 'foo'})
+            collection.post({'_key': 'bar'})
+            collection.delete('foo')
+            collection.delete_many(['bar'])
+        urls = [url for url, _ in collection.conn.posts]
+        self.assertNotIn(collection.endpoint, urls)
+
+    def test_delete_during_flush(self):
+        collection = self._create_collection()
+        buf = collection.write_behind(interval=None)
+        conn = collection.conn
+        posting, release = threading.Event(), threading.Event()
+        post, delete, events = conn.post, conn.delete, []
+
+        def slow_post(url, data=None):
+            posting.set()
+            release.wait(5)
+            events.append('post')
+            return post(url, data)
+
+        def logged_delete(url):
+            events.append('delete')
+            return delete(url)
+
+        conn.post, conn.delete = slow_post, logged_delete
+        collection.post({'_key': 'foo'})
+        flush = threading.Thread(target=buf.flush)
+        flush.start()
+        posting.wait(5)
+        deleting = threading.Thread(target=collection.delete, args=('foo',))
+        deleting.start()
+        # The delete waits for the write in flight.
+        time.sleep(0.05)
+        self.assertEqual(events, [])
+        release.set()
+        flush.join()
+        deleting.join()
+        self.assertEqual(events, ['post', 'delete'])
+
+    def test_failure_after_discard(self):
+        collection = self._create_collection(fail_after=0)
+        buf = collection.write_behind(interval=None)
+        post = collection.conn.post
+
+        def post_and_discard(url, data=None):
+            buf.discard(['foo'])
+            return post(url, data)
+
+        collection.conn.post = post_and_discard
+        collection.post_many([{'_key': 'foo'}, {'_key': 'bar'}])
+        with self.assertRaises(WriteBehindError):
+            buf.flush()
+        # The discarded item is not queued again.
+        self.assertEqual(len(buf), 1)
+
+    def test_failure(self):
+        collection = self._create_collection(fail_after=0)
+        buf = collection.write_behind(interval=None)
+        collection.post({'_key': 'foo', 'value': 1})
+        with self.assertRaises(WriteBehindError) as cm:
+            buf.flush()
+        self.assertEqual(len(cm.exception.errors), 1)
+        # Unwritten items are queued again, unless they are posted again.
+        self.assertEqual(len(buf), 1)
+        collection.conn.fail_after = None
+        collection.post({'_key': 'foo', 'value': 2})
+        buf.close()
+        self.assertEqual(self._posted_items(collection),
+                         [{'_key': 'foo', 'value': 2}])
+
+    def test_already_started(self):
+        collection = self._create_collection()
+        with collection.write_behind(interval=None):
+            with self.assertRaises(RuntimeError):
+                collection.write_behind()
+
+    def test_model_dirty_until_written(self):
+        class TestModel(Model):
+            value = Field()
+
+        collection = self._create_collection(fail_after=0)
+        buf = collection.write_behind(interval=None)
+        model = TestModel(collection).create(_key='foo', value=1)
+        self.assertTrue(model.save())
+        self.assertTrue(model.is_dirty)
+        with self.assertRaises(WriteBehindError):
+            buf.flush()
+        self.assertTrue(model.is_dirty)
+        collection.conn.fail_after = None
+        buf.flush()
+        self.assertFalse(model.is_dirty)
+        self.assertFalse(model.save())
+        # Changes made while the save is pending stay dirty.
+        model.value = 2
+        self.assertEqual(TestModel(collection).save_many([model]), [])
+        model.value = 3
+        buf.close()
+        self.assertEqual(model.changed_fields, set(['value']))
+        self.assertEqual(self._posted_items(collection), [
+            {'_key': 'foo', 'value': 1}, {'_key': 'foo', 'value': 2}])
@@ -0,0 +1,72 @@
+from unittest import TestCase
+from collector.cache import QueryCache
+
+
+class FakeClock(object):
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+class QueryCacheTest(TestCase):
+    def test_get_set(self):
+        cache = QueryCache()
+        params = [('key', 'foo'), ('meta', '_key')]
+        self.assertIsNone(cache.get(params))
+        cache.set(params, 'body')
+        self.assertEqual(cache.get(list(params)), 'body')
+        self.assertEqual((cache.hits, cache.misses), (1, 1))
+
+    def test_ttl(self):
+        clock = FakeClock()
+        cache = QueryCache(ttl=10, clock=clock)
+        cache.set([('key', 'foo')], 'body')
+        clock.now += 10
+        self.assertEqual(cache.get([('key', 'foo')]), 'body')
+        clock.now += 1
+        self.assertIsNone(cache.get([('key', 'foo')]))
+        self.assertEqual((len(cache), cache.size), (0, 0))
+
+    def test_lru_max_entries(self):
+        cache = QueryCache(max_entries=2)
+        cache.set([('key', 'a')], 'a')
+        cache.set([('key', 'b')], 'b')
+        cache.get([('key', 'a')])
+        cache.set([('key', 'c')], 'c')
+        self.assertIsNone(cache.get([('key', 'b')]))
+        self.assertEqual(cache.get([('key', 'a')]), 'a')
+        self.assertEqual(cache.get([('key', 'c')]), 'c')
+
+    def test_lru_max_bytes(self):
+        cache = QueryCache(max_bytes=10)
+        cache.set([('key', 'a')], 'x' * 6)
+        cache.set([('key', 'b')], 'x' * 4)
+        self.assertEqual(cache.size, 10)
+        cache.set([('key', 'c')], 'x' * 2)
+        self.assertIsNone(cache.get([('key', 'a')]))
+        self.assertEqual(cache.size, 6)
+        # Results larger than the cache are not cached at all.
+        cache.set([('key', 'd')], 'x' * 11)
+        self.assertIsNone(cache.get([('key', 'd')]))
+        self.assertEqual(cache.size, 6)
+
+    def test_invalidate(self):
+        cache = QueryCache()
+        cache.set([('key', 'foo')], 'foo')
+        cache.set([('prefix', 'ba')], 'ba')
+        cache.set([('startts', 1)], 'all')
+        cache.invalidate(['bar'])
+        self.assertEqual(cache.get([('key', 'foo')]), 'foo')
+        self.assertIsNone(cache.get([('prefix', 'ba')]))
+        self.assertIsNone(cache.get([('startts', 1)]))
+        cache.invalidate(['foo'])
+        self.assertIsNone(cache.get([('key', 'foo')]))
+
+    def test_stale_set(self):
+        cache = QueryCache()
+        generation = cache.generation
+        cache.invalidate(['foo'])
+        cache.set([('key', 'foo')], 'foo', generation)
+        self.assertIsNone(cache.get([('key', 'foo')]))
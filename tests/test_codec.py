@@ -0,0 +1,77 @@
+from unittest import TestCase, skipIf
+from collector.codec import (JsonCodec, available_codecs, get_codec, ujson,
+                             simplejson)
+from collector.iterators import JsonLinesIterator
+from helpers import CollectionTestMixin
+
+
+class CodecTestMixin(object):
+    data = [{'_key': 'foo', 'value': [1, 2.5, None]},
+            {'_key': u'b\xe4r', 'value': {'nested': True}}]
+
+    def _check_codec(self, codec):
+        lines = codec.dumps_many(self.data).split('\n')
+        self.assertEqual(len(lines), 2)
+        self.assertEqual(codec.loads_many(lines), self.data)
+        self.assertEqual(codec.loads_many(lines[:1]), self.data[:1])
+        self.assertEqual(codec.loads(codec.dumps(self.data[1])), self.data[1])
+
+    def _check_numbers(self, codec):
+        data = [{'_key': 'foo', 'value': 0.1 + 0.2},
+                {'_key': 'bar', 'value': 1.2345678901234567},
+                {'_key': 'baz', 'value': 2 ** 70, 'small': -2 ** 70}]
+        lines = codec.dumps_many(data).split('\n')
+        self.assertEqual(codec.loads_many(lines), data)
+        self.assertEqual(codec.loads(codec.dumps(data[2])), data[2])
+        self.assertEqual(codec.loads(lines[1])['value'], 1.2345678901234567)
+
+
+class CodecTest(TestCase, CodecTestMixin):
+    def test_json(self):
+        self._check_codec(JsonCodec())
+
+    def test_json_numbers(self):
+        self._check_numbers(JsonCodec())
+
+    @skipIf(simplejson is None, 'simplejson is not installed')
+    def test_simplejson(self):
+        self._check_codec(get_codec('simplejson'))
+
+    @skipIf(simplejson is None, 'simplejson is not installed')
+    def test_simplejson_numbers(self):
+        self._check_numbers(get_codec('simplejson'))
+
+    @skipIf(ujson is None, 'ujson is not installed')
+    def test_ujson(self):
+        self._check_codec(get_codec('ujson'))
+
+    @skipIf(ujson is None, 'ujson is not installed')
+    def test_ujson_numbers(self):
+        self._check_numbers(get_codec('ujson'))
+
+    def test_get_codec(self):
+        self.assertIn('json', available_codecs())
+        self.assertEqual(get_codec().name,
+                         'simplejson' if simplejson is not None else 'json')
+        codec = JsonCodec()
+        self.assertIs(get_codec(codec), codec)
+        with self.assertRaises(RuntimeError):
+            get_codec('unknown')
+
+
+class IteratorCodecTest(TestCase, CollectionTestMixin):
+    def test_batches(self):
+        lines = ['{"value": %d}' % i for i in range(300)]
+        self.assertEqual([d['value'] for d in JsonLinesIterator(lines)],
+                         range(300))
+
+    def test_collection_codec(self):
+        class _TestCodec(JsonCodec):
+            name = 'test'
+
+        codec = _TestCodec()
+        collection = self._create_collection(codec=codec)
+        self.assertIs(collection.iterator_cls.codec, codec)
+        self.assertTrue(issubclass(collection.iterator_cls, JsonLinesIterator))
+        # Other collections are not affected.
+        self.assertIsNot(JsonLinesIterator.codec, codec)
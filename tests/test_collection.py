@@ -0,0 +1,151 @@
+from unittest import TestCase
+from collector.cache import QueryCache
+from collector.collection import Collection
+from collector.connection import ConnectionRegistry
+from collector.exceptions import BulkWriteError
+from collector.iterators import JsonLinesIterator
+from helpers import CollectionTestMixin
+
+
+class PostManyTest(TestCase, CollectionTestMixin):
+    items = [{'_key': 'key%02d' % i, 'value': 'x' * 10} for i in range(10)]
+
+    def _posted_items(self, collection):
+        return [item for _, body in collection.conn.posts
+                for item in JsonLinesIterator(body)]
+
+    def test_max_items(self):
+        collection = self._create_collection()
+        results = collection.post_many(self.items, max_items=4)
+        self.assertEqual([r.items for r in results], [4, 4, 2])
+        self.assertEqual(len(collection.conn.posts), 3)
+        self.assertEqual(self._posted_items(collection), self.items)
+
+    def test_max_bytes(self):
+        collection = self._create_collection()
+        line_size = len(JsonLinesIterator.serialize(self.items[0]))
+        results = collection.post_many(self.items, max_bytes=line_size * 3 + 2)
+        self.assertEqual([r.items for r in results], [3, 3, 3, 1])
+        for result, (_, body) in zip(results, collection.conn.posts):
+            self.assertEqual(result.size, len(body))
+            self.assertLessEqual(result.size, line_size * 3 + 2)
+        self.assertEqual(self._posted_items(collection), self.items)
+
+    def test_oversized_item(self):
+        collection = self._create_collection()
+        results = collection.post_many(self.items[:2], max_bytes=1)
+        self.assertEqual([r.items for r in results], [1, 1])
+
+    def test_empty(self):
+        collection = self._create_collection()
+        self.assertEqual(collection.post_many(iter([])), [])
+        self.assertEqual(collection.conn.posts, [])
+
+    def test_failure(self):
+        collection = self._create_collection(fail_after=1)
+        with self.assertRaises(BulkWriteError) as cm:
+            collection.post_many(self.items, max_items=4)
+        self.assertEqual([r.items for r in cm.exception.results], [4])
+
+
+class DeleteManyTest(TestCase, CollectionTestMixin):
+    keys = ['key%02d' % i for i in range(5)]
+
+    def test_bulk_delete(self):
+        collection = self._create_collection()
+        results = collection.delete_many(iter(self.keys), max_keys=2)
+        self.assertEqual([r.items for r in results], [2, 2, 1])
+        urls = set(url for url, _ in collection.conn.posts)
+        self.assertEqual(urls, {collection.endpoint + '/deleted'})
+        deleted = [key for _, body in collection.conn.posts
+                   for key in JsonLinesIterator(body)]
+        self.assertEqual(deleted, self.keys)
+
+    def test_single_deletes(self):
+        collection = self._create_collection()
+        collection.bulk_delete = False
+        results = collection.delete_many(self.keys, max_workers=2)
+        self.assertEqual(len(results), 5)
+        self.assertEqual(sorted(collection.conn.deletes),
+                         [collection.endpoint + '/' + key for key in self.keys])
+
+    def test_single_deletes_failure(self):
+        collection = self._create_collection(fail_after=0)
+        collection.bulk_delete = False
+        with self.assertRaises(BulkWriteError):
+            collection.delete_many(self.keys)
+
+
+class ConnectionRegistryTest(TestCase):
+    def _create_collection_cls(self, **options):
+        class _TestCollection(Collection):
+            connection_registry = ConnectionRegistry(**options)
+
+        return _TestCollection
+
+    def test_shared_connection(self):
+        collection_cls = self._create_collection_cls()
+        c1 = collection_cls('1001', 'test1', apikey='apikey')
+        c2 = collection_cls('1002', 'test2', apikey='apikey')
+        c3 = collection_cls('1001', 'test1', apikey='another_apikey')
+        self.assertIs(c1.conn, c2.conn)
+        self.assertIsNot(c1.conn, c3.conn)
+
+        stats = collection_cls.connection_registry.stats()
+        self.assertEqual(stats['created'], 2)
+        self.assertEqual(stats['reused'], 1)
+        self.assertEqual(len(stats['connections']), 2)
+        self.assertEqual(stats['connections'][0]['host'],
+                         'storage.scrapinghub.com')
+        self.assertEqual(stats['connections'][0]['requests'], 0)
+
+    def test_options(self):
+        collection_cls = self._create_collection_cls(pool_maxsize=20,
+                                                     timeout=5)
+        conn = collection_cls('1001', 'test', apikey='apikey').conn
+        self.assertEqual(conn.timeout, 5)
+        self.assertEqual(conn.session.get_adapter('https://')._pool_maxsize,
+                         20)
+
+        collection_cls.connection_registry.configure(keep_alive=False)
+        conn = collection_cls('1001', 'test', apikey='apikey2').conn
+        self.assertEqual(conn.session.headers['Connection'], 'close')
+
+    def test_no_registry(self):
+        collection_cls = self._create_collection_cls()
+        collection_cls.connection_registry = None
+        c1 = collection_cls('1001', 'test', apikey='apikey')
+        c2 = collection_cls('1001', 'test', apikey='apikey')
+        self.assertIsNot(c1.conn, c2.conn)
+
+
+class CachedCollectionTest(TestCase, CollectionTestMixin):
+    def test_cached_request(self):
+        collection = self._create_collection(cache=QueryCache())
+        params = [('key', 'foo')]
+        self.assertEqual(collection.request(params), '{"_key": "foo"}')
+        self.assertEqual(collection.request(params), '{"_key": "foo"}')
+        self.assertEqual(len(collection.conn.requests), 1)
+        self.assertEqual(collection.cache.hits, 1)
+
+    def test_invalidation(self):
+        collection = self._create_collection(cache=QueryCache())
+        foo, bar = [('key', 'foo')], [('key', 'bar')]
+        writes = [
+            lambda: collection.post({'_key': 'foo'}),
+            lambda: collection.post_many([{'_key': 'foo'}]),
+            lambda: collection.delete('foo'),
+            lambda: collection.delete_many(['foo']),
+        ]
+        for write in writes:
+            collection.request(foo)
+            collection.request(bar)
+            write()
+            self.assertIsNone(collection.cache.get(foo))
+            self.assertIsNotNone(collection.cache.get(bar))
+
+    def test_invalidation_without_key(self):
+        collection = self._create_collection(cache=QueryCache())
+        collection.request([('key', 'foo')])
+        collection.post({'value': 'no key'})
+        self.assertEqual(len(collection.cache), 0)
@@ -0,0 +1,51 @@
+from unittest import TestCase, skipIf
+from collector.columns import numpy, to_columns
+from collector.field import Field
+from collector.model import Model
+from helpers import StubCollection
+
+
+@skipIf(numpy is None, 'numpy is not installed')
+class ColumnsTest(TestCase):
+    rows = [
+        {'_key': 'foo', '_ts': 1, 'count': 1, 'ratio': 0.5, 'flag': True,
+         'name': 'foo_name'},
+        {'_key': 'bar', '_ts': 2, 'count': 2, 'ratio': 1, 'flag': False},
+        {'_key': 'baz', '_ts': 3, 'ratio': None, 'name': [1, 2]},
+    ]
+
+    def test_types(self):
+        columns = to_columns(self.rows, ['_ts', 'count', 'ratio', 'flag',
+                                         'name', 'missing'])
+        self.assertEqual(columns['_ts'].dtype, numpy.int64)
+        self.assertEqual(columns['count'].dtype, numpy.int64)
+        self.assertEqual(columns['ratio'].dtype, numpy.float64)
+        self.assertEqual(columns['flag'].dtype, numpy.bool_)
+        self.assertEqual(columns['name'].dtype, object)
+        self.assertEqual(columns['missing'].dtype, numpy.float64)
+
+    def test_values_and_masks(self):
+        columns = to_columns(self.rows, ['_ts', 'count', 'ratio', 'name',
+                                         'missing'])
+        self.assertEqual(columns['_ts'].tolist(), [1, 2, 3])
+        self.assertEqual(columns['count'].tolist(), [1, 2, None])
+        self.assertEqual(columns['count'].sum(), 3)
+        self.assertEqual(columns['ratio'].mask.tolist(), [False, False, True])
+        self.assertEqual(columns['name'].tolist(), ['foo_name', None, [1, 2]])
+        self.assertTrue(columns['missing'].mask.all())
+
+    def test_overflow(self):
+        columns = to_columns([{'big': 2 ** 70}, {'big': 1}], ['big'])
+        self.assertEqual(columns['big'].dtype, object)
+        self.assertEqual(columns['big'].tolist(), [2 ** 70, 1])
+
+    def test_query_result(self):
+        class _TestModel(Model):
+            count = Field()
+
+        tm = _TestModel(StubCollection(data=self.rows))
+        columns = tm.execute().to_columns()
+        self.assertEqual(sorted(columns), ['_key', '_ts', 'count'])
+        self.assertEqual(columns['_key'].tolist(), ['foo', 'bar', 'baz'])
+        columns = tm.execute().to_columns(fields=['ratio'])
+        self.assertEqual(columns['ratio'].tolist(), [0.5, 1.0, None])
@@ -0,0 +1,54 @@
+import threading
+from unittest import TestCase
+from collector.connection import HttpConnection
+from helpers import GzipHandler, ThreadingHTTPServer
+
+
+class GzipTest(TestCase):
+    def setUp(self):
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), GzipHandler)
+        self.server.posts = []
+        self.thread = threading.Thread(target=self.server.serve_forever,
+                                       args=(0.01,))
+        self.thread.daemon = True
+        self.thread.start()
+        self.url = 'http://127.0.0.1:%d/' % self.server.server_port
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def test_compressed_post(self):
+        conn = HttpConnection(compress=True, compress_min_size=100)
+        body = '\n'.join(['{"_key": "foo", "value": "bar"}'] * 100)
+        self.assertEqual(conn.post(self.url, data=body), 'ok')
+        conn.post(self.url, data='small')
+        self.assertEqual(self.server.posts, [('gzip', body), (None, 'small')])
+        self.assertEqual(conn.bytes_sent_uncompressed, len(body) + 5)
+        self.assertLess(conn.bytes_sent, len(body) / 4)
+
+    def test_uncompressed_post(self):
+        conn = HttpConnection(compress_min_size=100)
+        body = 'x' * 1000
+        conn.post(self.url, data=body)
+        self.assertEqual(self.server.posts, [(None, body)])
+        self.assertEqual(conn.bytes_sent, conn.bytes_sent_uncompressed)
+
+    def test_compressed_response(self):
+        conn = HttpConnection(compress=True)
+        response = conn.request(self.url)
+        self.assertEqual(response.headers['Content-Encoding'], 'gzip')
+        lines = list(response.iter_lines())
+        self.assertEqual('\n'.join(lines), GzipHandler.body)
+        stats = conn.stats()
+        self.assertEqual(stats['bytes_received_decompressed'],
+                         len(GzipHandler.body))
+        self.assertLess(stats['bytes_received'], len(GzipHandler.body) / 4)
+
+    def test_uncompressed_response(self):
+        conn = HttpConnection()
+        conn.session.headers['Accept-Encoding'] = 'identity'
+        conn.request(self.url).content
+        self.assertEqual(conn.bytes_received, len(GzipHandler.body))
+        self.assertEqual(conn.bytes_received_decompressed,
+                         len(GzipHandler.body))
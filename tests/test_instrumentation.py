@@ -0,0 +1,90 @@
+import threading
+from unittest import TestCase
+from collector.collection import Collection
+from collector.connection import ConnectionRegistry
+from collector.field import Field
+from collector.instrumentation import Instrumentation, PhaseStats
+from collector.iterators import JsonLinesIterator
+from collector.model import Model
+from helpers import GzipHandler, ThreadingHTTPServer
+
+
+class _TestModel(Model):
+    value = Field()
+
+
+class InstrumentationTest(TestCase):
+    def setUp(self):
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), GzipHandler)
+        self.server.posts = []
+        thread = threading.Thread(target=self.server.serve_forever,
+                                  args=(0.01,))
+        thread.daemon = True
+        thread.start()
+        self.stats = PhaseStats()
+
+        class _TestCollection(Collection):
+            base_uri = 'http://127.0.0.1:%d/' % self.server.server_port
+            connection_registry = ConnectionRegistry(
+                instrumentation=self.stats)
+
+        self.collection = _TestCollection('1001', 'test', apikey='apikey')
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def test_execute(self):
+        models = _TestModel(self.collection).prefix('key').execute().all()
+        self.assertEqual(len(models), 100)
+        stats = self.stats.stats()
+        self.assertEqual(stats['compile']['calls'], 1)
+        self.assertEqual(stats['request']['calls'], 1)
+        self.assertEqual(stats['request']['bytes'], 0)
+        self.assertEqual(stats['response']['calls'], 1)
+        self.assertEqual(stats['response']['bytes'],
+                         self.collection.conn.bytes_received)
+        self.assertEqual(stats['decode']['rows'], 100)
+        self.assertEqual(stats['hydrate']['rows'], 100)
+        self.assertEqual(self.stats.status_codes, {200: 1})
+        self.assertGreater(stats['request']['seconds'], 0)
+
+    def test_first(self):
+        _TestModel(self.collection).execute().first()
+        stats = self.stats.stats()
+        self.assertEqual(stats['hydrate']['rows'], 1)
+        self.assertEqual(stats['decode']['calls'], 1)
+
+    def test_post(self):
+        self.collection.post({'_key': 'foo', 'value': 'bar'})
+        stats = self.stats.stats()
+        self.assertEqual(stats['request']['bytes'],
+                         len(self.server.posts[0][1]))
+        self.assertEqual(stats['response']['bytes'], 2)
+        self.stats.clear()
+        self.assertEqual(self.stats.stats()['request']['calls'], 0)
+
+    def test_collection_instrumentation(self):
+        events = []
+
+        class _Instrumentation(Instrumentation):
+            def on_compile(self, params, seconds):
+                events.append(('compile', params))
+
+        collection = type(self.collection)('1001', 'test', apikey='apikey',
+                                           instrumentation=_Instrumentation())
+        _TestModel(collection).select('key1').execute().all()
+        self.assertEqual(events, [('compile', [('key', 'key1'),
+                                               ('meta', '_key'),
+                                               ('meta', '_ts')])])
+        # Connection phases are still reported to the connection's one.
+        self.assertEqual(self.stats.stats()['request']['calls'], 1)
+
+
+class JsonLinesIteratorInstrumentationTest(TestCase):
+    def test_decode(self):
+        stats = PhaseStats()
+        data = '\n'.join(['{"_key": "foo"}'] * 10)
+        self.assertEqual(len(list(JsonLinesIterator(data, stats))), 10)
+        self.assertEqual(stats.stats()['decode']['rows'], 10)
+        self.assertEqual(len(list(JsonLinesIterator(data))), 10)
@@ -0,0 +1,104 @@
+from unittest import TestCase
+from collector.iterators import JsonLinesIterator, close_pools
+from collector.exceptions import NoSuchElement
+from helpers import BasicTestModel
+
+
+class StreamedResponse(object):
+    """ Mimics streamed http response of requests library. """
+    def __init__(self, lines):
+        self.lines = lines
+        self.read = 0
+        self.closed = False
+
+    def iter_lines(self, chunk_size=512):
+        for line in self.lines:
+            self.read += 1
+            yield line
+
+    def close(self):
+        self.closed = True
+
+
+class JsonLinesIteratorTest(TestCase):
+    def test_string(self):
+        data = '{"_key": "foo"}\n{"_key": "bar"}\n'
+        result = list(JsonLinesIterator(data))
+        self.assertEqual(result, [{'_key': 'foo'}, {'_key': 'bar'}])
+
+    def test_empty(self):
+        self.assertEqual(list(JsonLinesIterator('')), [])
+        self.assertEqual(list(JsonLinesIterator(None)), [])
+
+    def test_streamed_response(self):
+        response = StreamedResponse(['{"_key": "foo"}', '', '{"_key": "bar"}'])
+        iterator = iter(JsonLinesIterator(response))
+        self.assertEqual(next(iterator), {'_key': 'foo'})
+        self.assertEqual(response.read, 1)
+        self.assertEqual(list(iterator), [{'_key': 'bar'}])
+
+    def test_serialize(self):
+        data = [{'_key': 'foo'}, {'_key': 'bar'}]
+        serialized = JsonLinesIterator.serialize(data)
+        self.assertEqual(list(JsonLinesIterator(serialized)), data)
+
+
+class StreamedQueryResultTest(TestCase):
+    def test_first_closes_response(self):
+        response = StreamedResponse(['{"_key": "foo"}', '{"_key": "bar"}'])
+        model = BasicTestModel()
+        model.collection.request = lambda *a, **kw: response
+        first = model.execute().first()
+        self.assertEqual(first._key, 'foo')
+        self.assertEqual(response.read, 1)
+        self.assertTrue(response.closed)
+
+    def test_first_closes_empty_response(self):
+        response = StreamedResponse([])
+        model = BasicTestModel()
+        model.collection.request = lambda *a, **kw: response
+        with self.assertRaises(NoSuchElement):
+            model.execute().first()
+        self.assertTrue(response.closed)
+
+
+class ParallelJsonLinesIteratorTest(TestCase):
+    iterator_cls = JsonLinesIterator.with_processes(2)
+    lines = ['{"_key": "key%03d", "value": %d}' % (i, i) for i in range(300)]
+
+    def setUp(self):
+        self.iterator_cls = type('_Iterator', (self.iterator_cls,),
+                                 {'parallel_chunk_size': 100})
+
+    @classmethod
+    def tearDownClass(cls):
+        close_pools()
+
+    def test_ordered(self):
+        result = list(self.iterator_cls('\n'.join(self.lines)))
+        self.assertEqual([data['value'] for data in result], range(300))
+
+    def test_unordered(self):
+        iterator_cls = self.iterator_cls.with_processes(2, ordered=False)
+        result = list(iterator_cls(StreamedResponse(self.lines + [''])))
+        self.assertEqual(sorted(data['value'] for data in result),
+                         range(300))
+
+    def test_failure(self):
+        lines = self.lines[:150] + ['{"broken'] + self.lines[150:]
+        for ordered in [True, False]:
+            iterator_cls = self.iterator_cls.with_processes(2, ordered)
+            with self.assertRaises(ValueError):
+                list(iterator_cls(lines))
+
+    def test_single_chunk(self):
+        iterator_cls = type('_Iterator', (self.iterator_cls,),
+                            {'parallel_chunk_size': 1024 * 1024})
+        self.assertEqual(len(list(iterator_cls(self.lines))), 300)
+        self.assertEqual(list(iterator_cls('')), [])
+
+    def test_models(self):
+        model = BasicTestModel(return_body='\n'.join(self.lines))
+        model.collection.iterator_cls = self.iterator_cls
+        self.assertEqual([m._key for m in model.execute()][-1], 'key299')
+        self.assertEqual(len(model.execute(raw=True).all()), 300)
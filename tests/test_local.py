@@ -0,0 +1,81 @@
+from unittest import TestCase
+from collector.field import Field
+from collector.local import LocalCollection
+from collector.model import Model
+
+
+class _TestModel(Model):
+    value = Field()
+
+
+class LocalCollectionTest(TestCase):
+    def setUp(self):
+        self.now = 10.0
+        self.collection = LocalCollection(data=[
+            {'_key': 'foo', '_ts': 1, 'value': 'foo_value'},
+            {'_key': 'foo1', '_ts': 2, 'value': 'foo1_value'},
+            {'_key': 'bar', '_ts': 3, 'value': 'bar_value'},
+        ], clock=lambda: self.now)
+        self.tm = _TestModel(self.collection)
+
+    def _keys(self, query):
+        return [m._key for m in query.execute()]
+
+    def test_queries(self):
+        self.assertEqual(self._keys(self.tm), ['bar', 'foo', 'foo1'])
+        self.assertEqual(self.tm.select('foo').execute().first().value,
+                         'foo_value')
+        self.assertEqual(self._keys(self.tm.select('foo1', 'missing')),
+                         ['foo1'])
+        self.assertEqual(self._keys(self.tm.prefix('fo')), ['foo', 'foo1'])
+        self.assertEqual(self._keys(self.tm.prefix('fo', prefixcount=1)),
+                         ['foo'])
+        self.assertEqual(self._keys(self.tm.when(startts=2)), ['bar', 'foo1'])
+        self.assertEqual(self._keys(self.tm.when(startts=1, endts=2)),
+                         ['foo', 'foo1'])
+        self.assertEqual(self._keys(self.tm.when(endts=1)), ['foo'])
+        self.assertEqual(self._keys(self.tm.page_size(2)),
+                         ['bar', 'foo', 'foo1'])
+        self.assertEqual(self._keys(self.tm.when(startts=2).limit(1)),
+                         ['bar'])
+
+    def test_post(self):
+        foo = self.tm.select('foo').execute().first()
+        foo.value = 'new_value'
+        foo.save()
+        self.tm.create(_key='baz', value='baz_value').save()
+        self.assertEqual(len(self.collection), 4)
+        self.assertEqual(self.tm.select('foo').execute().first().value,
+                         'new_value')
+        # Posted items get increasing _ts.
+        self.assertEqual([(m._key, m._ts) for m in
+                          self.tm.when(startts=10000).execute()],
+                         [('baz', 10001), ('foo', 10000)])
+        self.assertEqual(self._keys(self.tm.when(endts=3)),
+                         ['bar', 'foo1'])
+        self.assertEqual(self._keys(self.tm.prefix('ba')), ['bar', 'baz'])
+
+    def test_post_many(self):
+        results = self.collection.post_many(
+            {'_key': 'key%03d' % i, 'value': i} for i in range(100))
+        self.assertEqual(results[0].items, 100)
+        self.assertEqual(len(self._keys(self.tm.prefix('key'))), 100)
+        self.assertEqual(self._keys(self.tm.prefix('key09')),
+                         ['key09%d' % i for i in range(10)])
+        self.assertRaises(ValueError, self.collection.post, {'value': 1})
+
+    def test_delete(self):
+        self.tm.select('foo').execute().first().delete()
+        self.assertEqual(self._keys(self.tm), ['bar', 'foo1'])
+        self.tm.prefix('fo').delete()
+        self.assertEqual(self._keys(self.tm), ['bar'])
+        self.assertEqual(self._keys(self.tm.when(startts=1)), ['bar'])
+        self.collection.post({'_key': 'foo'})
+        self.collection.delete_many(['missing'])
+        self.assertEqual(self._keys(self.tm), ['bar', 'foo'])
+        self.assertEqual(self._keys(self.tm.when(startts=1)), ['bar', 'foo'])
+
+    def test_returns_copies(self):
+        self.collection.request([('key', 'foo')])[0]['value'] = 'changed'
+        self.assertEqual(self.tm.select('foo').execute().first().value,
+                         'foo_value')
@@ -0,0 +1,206 @@
+import os
+import shutil
+import tempfile
+from unittest import TestCase
+from collector.field import Field
+from collector.iterators import JsonLinesIterator
+from collector.mirror import select_keys
+from collector.model import Model
+from collector.utils import SortedKeys
+from helpers import CollectionTestMixin, StubCollection
+
+
+class _JsonStubCollection(StubCollection):
+    """ StubCollection which responds JSON lines. """
+    iterator_cls = JsonLinesIterator
+
+    def request(self, params=None):
+        return self.iterator_cls.serialize(
+            super(_JsonStubCollection, self).request(params))
+
+
+class _TestModel(Model):
+    value = Field()
+
+
+class SelectKeysTest(TestCase):
+    keys = ['bar', 'baz', 'foo', 'foo1', 'foo2']
+    ts = {'bar': 1, 'baz': 2, 'foo': 3, 'foo1': 4, 'foo2': 5}
+
+    def _select(self, *params):
+        return select_keys(params, SortedKeys(self.keys), self.ts.get)
+
+    def test_all(self):
+        self.assertEqual(self._select(), self.keys)
+        self.assertEqual(self._select(('meta', '_key')), self.keys)
+
+    def test_keys_and_prefixes(self):
+        self.assertEqual(self._select(('key', 'foo'), ('key', 'missing'),
+                                      ('prefix', 'ba')),
+                         ['bar', 'baz', 'foo'])
+        self.assertEqual(self._select(('prefix', 'foo'),
+                                      ('prefixcount', 2)), ['foo', 'foo1'])
+
+    def test_when(self):
+        self.assertEqual(self._select(('startts', 2), ('endts', 4)),
+                         ['baz', 'foo', 'foo1'])
+        self.assertEqual(self._select(('prefix', 'foo'), ('startts', 4),
+                                      ('prefixcount', 1)), ['foo1'])
+
+    def test_pagination(self):
+        self.assertEqual(self._select(('startafter', 'baz'), ('count', 2)),
+                         ['foo', 'foo1'])
+        self.assertEqual(select_keys([('startts', 2), ('startafter', 'baz'),
+                                      ('count', 2)],
+                                     SortedKeys(self.keys), self.ts.get,
+                                     lambda startts, endts: reversed(
+                                         self.keys[1:])),
+                         ['foo', 'foo1'])
+        self.assertEqual(self._select(('prefix', 'foo'),
+                                      ('startafter', 'foo'), ('count', 1)),
+                         ['foo1'])
+
+
+class SortedKeysTest(TestCase):
+    def test_chunks(self):
+        keys = SortedKeys(['key%03d' % i for i in range(0, 100, 2)])
+        keys.chunk_size = 4
+        for i in range(1, 100, 2) + [0, 99]:
+            keys.add('key%03d' % i)
+        self.assertEqual(list(keys), ['key%03d' % i for i in range(100)])
+        self.assertEqual(len(keys), 100)
+        self.assertTrue(all(len(chunk) <= 8 for chunk in keys._chunks))
+        for i in range(0, 100, 3) + [500]:
+            keys.discard('key%03d' % i)
+        expected = ['key%03d' % i for i in range(100) if i % 3]
+        self.assertEqual(list(keys), expected)
+        self.assertEqual(len(keys), len(expected))
+        self.assertIn('key001', keys)
+        self.assertNotIn('key003', keys)
+        self.assertNotIn('zzz', keys)
+        self.assertEqual(list(keys.iter_from('key050')), expected[33:])
+        self.assertEqual(list(keys.iter_from('key050', after=True)),
+                         expected[34:])
+        self.assertEqual(list(keys.iter_from('key0505')), expected[34:])
+        self.assertEqual(list(keys.iter_from('zzz')), [])
+        for key in expected:
+            keys.discard(key)
+        self.assertEqual((list(keys), len(keys)), ([], 0))
+        self.assertNotIn('key001', keys)
+
+
+class CollectionMirrorTest(TestCase, CollectionTestMixin):
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.path = os.path.join(self.tmp_dir, 'mirror.jl')
+        self.collection = _JsonStubCollection(data=[
+            {'_key': 'foo', '_ts': 1, 'value': 'foo_value'},
+            {'_key': 'bar', '_ts': 2, 'value': 'bar_value'},
+            {'_key': 'baz', '_ts': 3, 'value': 'baz_value'},
+        ])
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def _create_mirror(self):
+        collection = self._create_collection()
+        collection.request = self.collection.request
+        collection.post = self.collection.post
+        collection.delete = self.collection.delete
+        return collection.mirror(self.path)
+
+    def test_queries(self):
+        mirror = self._create_mirror()
+        self.assertEqual(len(mirror), 3)
+        self.assertEqual(mirror.last_ts, 3)
+        tm = _TestModel(mirror)
+        requests = len(self.collection.requests)
+        self.assertEqual([m._key for m in tm.execute()],
+                         ['bar', 'baz', 'foo'])
+        self.assertEqual(tm.select('foo').execute().first().value,
+                         'foo_value')
+        self.assertEqual([m._key for m in tm.prefix('ba', prefixcount=1)
+                          .execute()], ['bar'])
+        self.assertEqual([m._key for m in tm.when(startts=2, endts=2)
+                          .execute()], ['bar'])
+        self.assertEqual([m._key for m in tm.page_size(2).execute()],
+                         ['bar', 'baz', 'foo'])
+        self.assertEqual(len(self.collection.requests), requests)
+
+    def test_incremental_refresh(self):
+        self._create_mirror().close()
+        self.collection.data[0].update({'_ts': 4, 'value': 'new_value'})
+        self.collection.data.append({'_key': 'qux', '_ts': 5})
+        mirror = self._create_mirror()
+        self.assertEqual(self.collection.requests[-1][0], ('startts', 3))
+        self.assertEqual(len(mirror), 4)
+        self.assertEqual(mirror.last_ts, 5)
+        tm = _TestModel(mirror)
+        self.assertEqual(tm.select('foo').execute().first().value,
+                         'new_value')
+        self.assertEqual([m._key for m in tm.when(startts=4).execute()],
+                         ['foo', 'qux'])
+
+    def test_refresh_skips_unchanged(self):
+        mirror = self._create_mirror()
+        size = os.path.getsize(self.path)
+        # The items of the last _ts are fetched again, but not written.
+        self.assertEqual(mirror.refresh(), 0)
+        self.assertEqual(self.collection.requests[-1][0], ('startts', 3))
+        self.assertEqual(os.path.getsize(self.path), size)
+        self.collection.data[2]['_ts'] = 4
+        self.assertEqual(mirror.refresh(), 1)
+
+    def test_delete_compacts(self):
+        mirror = self._create_mirror()
+        tm = _TestModel(mirror)
+        tm.select('foo').execute().first().delete()
+        self.assertGreater(os.path.getsize(self.path), mirror._live_size())
+        tm.select('bar').execute().first().delete()
+        self.assertEqual(os.path.getsize(self.path), mirror._live_size())
+        self.assertEqual([m.value for m in tm.execute()], ['baz_value'])
+
+    def test_index_saved_lazily(self):
+        mirror = self._create_mirror()
+        tm = _TestModel(mirror)
+        with open(mirror.index_path) as f:
+            index = f.read()
+        tm.create(_key='qux', value='qux_value').save()
+        tm.create(_key='foo', value='new_value').save()
+        tm.select('bar').execute().first().delete()
+        with open(mirror.index_path) as f:
+            self.assertEqual(f.read(), index)
+        self.assertEqual(tm.select('foo').execute().first().value,
+                         'new_value')
+        self.assertEqual(mirror._live_size(), sum(
+            length + 1 for _, length, _ in mirror._index.values()))
+        mirror.close()
+        mirror = self._create_mirror()
+        self.assertEqual([m.value for m in _TestModel(mirror).execute()],
+                         ['baz_value', 'new_value', 'qux_value'])
+
+    def test_compact(self):
+        mirror = self._create_mirror()
+        for ts in range(4, 20):
+            self.collection.data[0]['_ts'] = ts
+            mirror.refresh()
+        size = os.path.getsize(self.path)
+        self.assertLessEqual(size, 2 * mirror._live_size())
+        mirror.compact()
+        self.assertEqual(os.path.getsize(self.path), mirror._live_size())
+        self.assertEqual(_TestModel(mirror).select('foo').execute().first()
+                         ._ts, 19)
+
+    def test_writes(self):
+        mirror = self._create_mirror()
+        tm = _TestModel(mirror)
+        tm.create(_key='qux', value='qux_value').save()
+        foo = tm.select('foo').execute().first()
+        foo.delete()
+        self.assertEqual([m._key for m in tm.execute()],
+                         ['bar', 'baz', 'qux'])
+        self.assertEqual(sorted(d['_key'] for d in self.collection.data),
+                         ['bar', 'baz', 'qux'])
+        # Posted items have no _ts until the next refresh.
+        self.assertEqual([m._key for m in tm.when(startts=1).execute()],
+                         ['bar', 'baz'])
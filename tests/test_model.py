@@ -1,7 +1,8 @@
 from unittest import TestCase
-from collector.field import Field
+from collector.field import Field, FieldDescriptor
 from collector.model import Model
 from collector.exceptions import NoSuchElement
+from collector.identity import IdentityMap
 from helpers import BasicTestModel, FixedTestDataMixin, StubCollection
 
 
@@ -144,6 +145,12 @@ class ModelDataTest(TestCase, FixedTestDataMixin):
         self.assertEqual(tm_new2.value, 'new_value')
         self.assertEqual(tm_new2.prop, 'new_prop')
 
+    def test_save_many(self):
+        tm = self._create_model_for_test_data([])
+        models = [tm.create(_key='key%d' % i, value=i) for i in range(3)]
+        tm.save_many(models)
+        self.assertEqual([d.value for d in tm.execute()], [0, 1, 2])
+
     def test_delete_field(self):
         test_data = [{'_key': 'delete_test', 'value': 'foo', 'prop': 'bar'}]
         tm = self._create_model_for_test_data(test_data)
@@ -172,6 +179,356 @@ class ModelDataTest(TestCase, FixedTestDataMixin):
         with self.assertRaises(NoSuchElement):
             tm.select('baz').execute().first()
 
+    def test_delete_query(self):
+        tm = self._create_model_for_test_data(list(self.test_data))
+        tm.prefix('ba').delete()
+        self.assertEqual([d._key for d in tm.execute()], ['foo'])
+
+
+class ModelPaginationTest(TestCase):
+    test_data = [{'_key': 'key%02d' % i, 'value': i} for i in range(10)]
+
+    def _create_model(self):
+        class _TestModel(Model):
+            value = Field()
+
+        return _TestModel(StubCollection(data=list(self.test_data)))
+
+    def test_page_size(self):
+        tm = self._create_model()
+        result = tm.page_size(3).execute()
+        self.assertEqual([d.value for d in result], range(10))
+        # 3 full pages and the last page with one entry.
+        self.assertEqual(len(tm.collection.requests), 4)
+        self.assertIn(('startafter', 'key05'), tm.collection.requests[2])
+
+    def test_limit(self):
+        tm = self._create_model()
+        result = tm.limit(4).execute().all()
+        self.assertEqual([d.value for d in result], range(4))
+
+        result = tm.limit(4).page_size(3).execute().all()
+        self.assertEqual([d.value for d in result], range(4))
+        self.assertIn(('count', 1), tm.collection.requests[-1])
+
+    def test_iter_pages(self):
+        tm = self._create_model()
+        pages = list(tm.prefix('key0').page_size(4).iter_pages())
+        self.assertEqual([len(page) for page in pages], [4, 4, 2])
+        self.assertEqual(pages[1][0]._key, 'key04')
+
+        pages = list(tm.iter_pages())
+        self.assertEqual([len(page) for page in pages], [10])
+
+    def test_paginated_first(self):
+        tm = self._create_model()
+        self.assertEqual(tm.page_size(2).execute().first()._key, 'key00')
+        self.assertEqual(len(tm.collection.requests), 1)
+
+
+class ModelIdentityMapTest(TestCase):
+    def _create_model(self):
+        class _TestModel(Model):
+            value = Field()
+
+        data = [{'_key': 'foo', '_ts': 1, 'value': 'foo_value'},
+                {'_key': 'bar', '_ts': 1, 'value': 'bar_value'}]
+        return _TestModel(StubCollection(data=data))
+
+    def test_same_instance(self):
+        tm = self._create_model()
+        tm.identity_map = IdentityMap()
+        foo = tm.select('foo').execute().first()
+        foo.value = 'local change'
+        self.assertIs(tm.prefix('f').execute().first(), foo)
+        self.assertIs(foo.create(_key='baz').identity_map, tm.identity_map)
+        # Unchanged _ts does not refresh the instance.
+        self.assertEqual(foo.value, 'local change')
+        self.assertEqual(len(tm.identity_map), 1)
+
+    def test_refresh(self):
+        tm = self._create_model()
+        tm.identity_map = IdentityMap()
+        foo = tm.select('foo').execute().first()
+        tm.collection.data[0] = {'_key': 'foo', '_ts': 2, 'value': 'new'}
+        foo2 = tm.select('foo').execute().first()
+        self.assertIs(foo2, foo)
+        self.assertEqual((foo._ts, foo['_ts'], foo.value), (2, 2, 'new'))
+
+    def test_delete(self):
+        tm = self._create_model()
+        with IdentityMap() as identity_map:
+            tm.identity_map = identity_map
+            tm.select('foo').execute().first().delete()
+            self.assertEqual(len(identity_map), 0)
+            tm.select('bar').execute().first()
+        self.assertEqual(len(identity_map), 0)
+
+    def test_collections(self):
+        tm = self._create_model()
+        other = tm.__class__(StubCollection(data=[
+            {'_key': 'foo', '_ts': 1, 'value': 'other_value'}]))
+        tm.identity_map = other.identity_map = IdentityMap()
+        foo = tm.select('foo').execute().first()
+        other_foo = other.select('foo').execute().first()
+        self.assertIsNot(other_foo, foo)
+        self.assertEqual(other_foo.value, 'other_value')
+        self.assertIs(other.select('foo').execute().first(), other_foo)
+        self.assertEqual(len(tm.identity_map), 2)
+
+    def test_without_identity_map(self):
+        tm = self._create_model()
+        self.assertIsNot(tm.select('foo').execute().first(),
+                         tm.select('foo').execute().first())
+
+
+class ModelDirtyTrackingTest(TestCase, FixedTestDataMixin):
+    def _create_model(self):
+        tm = self._create_model_for_test_data(
+            [dict(data) for data in self.test_data])
+        posts = []
+        post = tm.collection.post
+        tm.collection.post = lambda data: posts.append(data) or post(data)
+        return tm, posts
+
+    def test_fetched_is_clean(self):
+        tm, posts = self._create_model()
+        foo = tm.select('foo').execute().first()
+        self.assertFalse(foo.is_dirty)
+        self.assertEqual(foo.changed_fields, set())
+        self.assertFalse(foo.save())
+        self.assertEqual(posts, [])
+
+    def test_new_is_dirty(self):
+        tm, posts = self._create_model()
+        new = tm.create(_key='new', value='new_value')
+        self.assertTrue(new.is_dirty)
+        self.assertEqual(new.changed_fields, {'value'})
+        self.assertTrue(new.save())
+        self.assertFalse(new.is_dirty)
+        self.assertFalse(new.save())
+        self.assertEqual(len(posts), 1)
+
+    def test_changes(self):
+        tm, posts = self._create_model()
+        foo = tm.select('foo').execute().first()
+        foo.value = 'changed'
+        self.assertEqual(foo.changed_fields, {'value'})
+        foo['prop'] = 'changed'
+        self.assertEqual(foo.changed_fields, {'value', 'prop'})
+        foo.value = 'foo_value'
+        self.assertEqual(foo.changed_fields, {'prop'})
+        del foo['prop']
+        self.assertEqual(foo.changed_fields, {'prop'})
+        # Non-Field items are not saved, hence they are not tracked.
+        foo['undeclared'] = 'value'
+        self.assertEqual(foo.changed_fields, {'prop'})
+        self.assertTrue(foo.save())
+        self.assertFalse(foo.is_dirty)
+
+    def test_mark_changed(self):
+        tm, posts = self._create_model()
+        foo = tm.select('foo').execute().first()
+        foo.mark_changed('value')
+        self.assertTrue(foo.save())
+
+    def test_force(self):
+        tm, posts = self._create_model()
+        foo = tm.select('foo').execute().first()
+        self.assertTrue(foo.save(force=True))
+        self.assertEqual(len(posts), 1)
+
+    def test_save_many(self):
+        tm, _ = self._create_model()
+        saved = []
+        tm.collection.post_many = lambda data: saved.extend(data)
+        foo, bar, baz = tm.execute().all()
+        bar.value = 'changed'
+        tm.save_many([foo, bar, baz])
+        self.assertEqual([data['_key'] for data in saved], [bar._key])
+        self.assertFalse(bar.is_dirty)
+        tm.save_many([foo, bar, baz], force=True)
+        self.assertEqual(len(saved), 4)
+
+
+class ModelRowModeTest(TestCase):
+    test_data = [{'_key': 'foo', '_ts': 1, 'value': 'foo_value', 'blob': 'x'},
+                 {'_key': 'bar', '_ts': 2, 'blob': 'y'}]
+
+    def _create_model(self):
+        class _TestModel(Model):
+            value = Field()
+
+        return _TestModel(StubCollection(data=self.test_data))
+
+    def test_raw(self):
+        tm = self._create_model()
+        self.assertEqual(tm.execute(raw=True).all(), self.test_data)
+        self.assertEqual(tm.select('bar').execute(raw=True).first(),
+                         self.test_data[1])
+
+    def test_values(self):
+        tm = self._create_model()
+        self.assertEqual(list(tm.execute().values()), [
+            {'_key': 'foo', '_ts': 1, 'value': 'foo_value'},
+            {'_key': 'bar', '_ts': 2}])
+
+    def test_tuples(self):
+        tm = self._create_model()
+        foo, bar = tm.execute().tuples()
+        self.assertEqual(foo, ('foo', 1, 'foo_value'))
+        self.assertEqual((bar._key, bar._ts, bar.value), ('bar', 2, None))
+        self.assertEqual(foo._asdict(),
+                         {'_key': 'foo', '_ts': 1, 'value': 'foo_value'})
+        self.assertEqual(repr(bar), "_TestModelRecord(_key='bar', _ts=2, "
+                                    "value=None)")
+        with self.assertRaises(AttributeError):
+            foo.value = 'immutable'
+
+    def test_only(self):
+        tm = self._create_model()
+        self.assertEqual(tm.only().execute(raw=True).all(), [
+            {'_key': 'foo', '_ts': 1, 'value': 'foo_value'},
+            {'_key': 'bar', '_ts': 2}])
+        self.assertEqual(tm.only('blob').execute(raw=True).first(),
+                         {'_key': 'foo', '_ts': 1, 'blob': 'x'})
+        pages = list(tm.only().page_size(1).iter_pages(raw=True))
+        self.assertEqual(pages, [[{'_key': 'bar', '_ts': 2}],
+                                 [{'_key': 'foo', '_ts': 1,
+                                   'value': 'foo_value'}]])
+        foo = tm.select('foo').only('blob').execute().first()
+        self.assertEqual((foo._key, foo.value), ('foo', None))
+
+    def test_only_without_fields(self):
+        tm = Model(StubCollection(data=self.test_data))
+        self.assertEqual(tm.only().execute(raw=True).all(),
+                         [{'_key': 'foo', '_ts': 1}, {'_key': 'bar', '_ts': 2}])
+
+    def test_only_partial(self):
+        tm = self._create_model()
+        posts = []
+        tm.collection.post = posts.append
+        tm.collection.post_many = lambda data: posts.extend(data)
+        foo = tm.select('foo').only('blob').execute().first()
+        foo.value = 'changed'
+        with self.assertRaises(RuntimeError):
+            foo.save()
+        with self.assertRaises(RuntimeError):
+            tm.save_many([foo])
+        self.assertEqual(posts, [])
+        # Instances which have all of the declared fields could be saved.
+        foo = tm.select('foo').only().execute().first()
+        foo.value = 'changed'
+        foo.save()
+        self.assertEqual(posts,
+                         [{'_key': 'foo', '_ts': 1, 'value': 'changed'}])
+
+    def test_only_partial_identity_map(self):
+        tm = self._create_model()
+        tm.identity_map = IdentityMap()
+        foo = tm.select('foo').only('blob').execute().first()
+        self.assertTrue(foo._partial)
+        # The partial instance is completed by a query of all fields.
+        self.assertIs(tm.select('foo').execute().first(), foo)
+        self.assertFalse(foo._partial)
+        self.assertEqual(foo.value, 'foo_value')
+
+    def test_raw_pages(self):
+        tm = self._create_model()
+        pages = list(tm.page_size(1).iter_pages(raw=True))
+        self.assertEqual(pages, [[self.test_data[1]], [self.test_data[0]]])
+
+
+class ModelHydrationTest(TestCase):
+    def _create_model(self):
+        class _TestModel(Model):
+            value = Field()
+            prop = Field()
+
+        return _TestModel(StubCollection(), logname='test')
+
+    def test_same_as_create(self):
+        tm = self._create_model()
+        data = {'_key': 'foo', '_ts': 1, 'value': 'foo_value'}
+        hydrated = tm._hydrate(tm, data)
+        created = tm.create(**data)
+        created._mark_clean()
+        self.assertIs(type(hydrated), type(created))
+        for name, value in created.__dict__.items():
+            if name != 'model':
+                self.assertEqual(hydrated.__dict__[name], value)
+        # Missing fields are set to None, which is the default anyway.
+        extra = set(hydrated.__dict__) - set(created.__dict__)
+        self.assertEqual(extra, {'prop'})
+        self.assertIsNone(hydrated.prop)
+        self.assertIs(hydrated.model, hydrated)
+        self.assertEqual((hydrated._key, hydrated._ts), ('foo', 1))
+        self.assertEqual(hydrated, {'_key': 'foo', '_ts': 1,
+                                    'value': 'foo_value'})
+        hydrated.prop = 'changed'
+        self.assertEqual(hydrated.changed_fields, {'prop'})
+
+    def test_logger(self):
+        tm = type(self._create_model())(StubCollection())
+        hydrated = tm._hydrate(tm, {'_key': 'foo'})
+        self.assertEqual(hydrated.logger, tm.create().logger)
+
+    def test_custom_init(self):
+        class _TestModel(Model):
+            value = Field()
+
+            def __init__(self, collection, logname=None, **kwargs):
+                super(_TestModel, self).__init__(collection, logname, **kwargs)
+                self.extra = 'extra'
+
+        tm = _TestModel(StubCollection(data=[{'_key': 'foo', 'value': 'x'}]))
+        foo = tm.execute().first()
+        self.assertEqual(foo.extra, 'extra')
+        self.assertEqual(foo.value, 'x')
+        self.assertFalse(foo.is_dirty)
+
+    def test_custom_init_mixin(self):
+        class _Mixin(object):
+            def __init__(self, *args, **kwargs):
+                super(_Mixin, self).__init__(*args, **kwargs)
+                self.extra = 'extra'
+
+        class _TestModel(_Mixin, Model):
+            value = Field()
+
+        class _SubModel(_TestModel):
+            pass
+
+        tm = _SubModel(StubCollection(data=[{'_key': 'foo', 'value': 'x'}]))
+        self.assertEqual(tm.execute().first().extra, 'extra')
+
+    def test_missing_field_warned_once(self):
+        tm = self._create_model()
+        warnings = []
+        tm.logger.warn = warnings.append
+        for i in range(3):
+            tm._hydrate(tm, {'_key': str(i), 'undeclared': i})
+        self.assertEqual(len(warnings), 1)
+
+    def test_custom_descriptor(self):
+        class _Descriptor(FieldDescriptor):
+            def __get__(self, instance, owner):
+                value = super(_Descriptor, self).__get__(instance, owner)
+                return value and value.upper()
+
+        class _Field(Field):
+            def add_to_class(self, obj, name):
+                setattr(obj, name, _Descriptor(name))
+
+        class _TestModel(Model):
+            value = _Field()
+
+        tm = _TestModel(StubCollection(data=[{'_key': 'foo', 'value': 'x'}]))
+        self.assertFalse(_TestModel._plain_fields)
+        foo = tm.execute().first()
+        self.assertEqual(foo.value, 'X')
+        self.assertFalse(foo.is_dirty)
+
 
 class ModelDictInterfaceTest(TestCase, FixedTestDataMixin):
     def test_getter(self):
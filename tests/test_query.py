@@ -1,5 +1,11 @@
+import threading
 from unittest import TestCase
-from helpers import BasicTestModel
+from urllib import urlencode
+from collector.field import Field
+from collector.local import LocalCollection
+from collector.model import Model
+from collector.query import execute_many, optimize_params, split_params
+from helpers import BasicTestModel, FixedTestDataMixin, StubCollection
 
 
 class QueryChainTest(TestCase):
@@ -110,3 +116,129 @@ class HttpApiQueryTest(TestCase):
         self.assertTrue({('prefix', 'foo'), ('prefix', 'bar'),
                          ('prefixcount', 10)} < query_data)
 
+
+    def test_limit(self):
+        model = BasicTestModel()
+        query = model.prefix('foo').limit(5)
+        query_data = set(self._compile_query(query))
+        self.assertTrue({('prefix', 'foo'), ('count', 5)} < query_data)
+
+    def test_only(self):
+        model = BasicTestModel()
+        query = model.only('foo', 'bar')
+        self.assertEqual(self._compile_query(query), model._extra_http_queries)
+
+        model.collection.projection_param = 'field'
+        query_data = set(self._compile_query(query))
+        self.assertTrue({('field', 'foo'), ('field', 'bar')} < query_data)
+
+    def test_page_size(self):
+        model = BasicTestModel()
+        query = model.prefix('foo').page_size(5)
+        query_data = set(self._compile_query(query))
+        self.assertNotIn('count', [key for key, _ in query_data])
+
+        with self.assertRaises(ValueError):
+            model.page_size(0)
+
+
+class QueryPlanTest(TestCase):
+    def test_duplicates(self):
+        model = BasicTestModel()
+        query = model.select('foo', 'bar', 'foo').prefix('baz', 'baz')
+        qchain = model._sort_chain(model._get_chain(query))
+        self.assertEqual(model._compile_query_chain(qchain),
+                         [('prefix', 'baz'), ('key', 'foo'), ('key', 'bar'),
+                          ('meta', '_key'), ('meta', '_ts')])
+
+    def test_covered(self):
+        params = [('prefix', 'fo'), ('prefix', 'foo'), ('prefix', 'ba'),
+                  ('key', 'foo1'), ('key', 'fo'), ('key', 'bar'),
+                  ('key', 'qux'), ('startts', 1)]
+        self.assertEqual(optimize_params(params),
+                         [('prefix', 'fo'), ('prefix', 'ba'), ('key', 'qux'),
+                          ('startts', 1)])
+        # Prefixcount limits the data per prefix, the keys are still needed.
+        params = [('prefix', 'fo'), ('prefixcount', 1), ('key', 'foo1'),
+                  ('key', 'foo1')]
+        self.assertEqual(optimize_params(params),
+                         [('prefix', 'fo'), ('prefixcount', 1),
+                          ('key', 'foo1')])
+
+    def test_split(self):
+        params = [('key', 'key%03d' % i) for i in range(100)] + [
+            ('meta', '_key'), ('count', 5)]
+        self.assertEqual(split_params(params, 10000), [params])
+        groups = split_params(params, 200, base_length=20)
+        self.assertGreater(len(groups), 1)
+        for group in groups:
+            self.assertLessEqual(len(urlencode(group)) + 20, 200)
+            self.assertEqual(group[-2:], [('meta', '_key'), ('count', 5)])
+        self.assertEqual(sum(len(group) - 2 for group in groups), 100)
+
+    def test_split_request(self):
+        class _TestCollection(LocalCollection):
+            endpoint = 'http://localhost/collections/1/s/test'
+            max_url_length = 100
+
+            def request(self, params=None):
+                self.requests = getattr(self, 'requests', 0) + 1
+                return super(_TestCollection, self).request(params)
+
+        class _TestModel(Model):
+            value = Field()
+
+        collection = _TestCollection(data=[{'_key': 'key%02d' % i, 'value': i}
+                                           for i in range(50)])
+        model = _TestModel(collection)
+        keys = ['key%02d' % i for i in range(49, -1, -2)] + ['missing']
+        result = model.select(*keys).prefix('key0').execute()
+        self.assertEqual([m._key for m in result],
+                         ['key%02d' % i for i in range(10)]
+                         + ['key%02d' % i for i in range(11, 50, 2)])
+        self.assertGreater(collection.requests, 1)
+        result = model.select(*keys).limit(3).execute()
+        self.assertEqual([m.value for m in result], [1, 3, 5])
+        pages = list(model.select(*keys).page_size(10).iter_pages())
+        self.assertEqual([len(page) for page in pages], [10, 10, 5])
+
+
+class ConcurrentStubCollection(StubCollection):
+    """ Blocks every request until given number of requests are running. """
+    def __init__(self, *a, **kw):
+        self.concurrency = kw.pop('concurrency')
+        super(ConcurrentStubCollection, self).__init__(*a, **kw)
+        self.running = 0
+        self.lock = threading.Lock()
+        self.all_running = threading.Event()
+
+    def request(self, params=None):
+        with self.lock:
+            self.running += 1
+            if self.running >= self.concurrency:
+                self.all_running.set()
+        self.all_running.wait(5)
+        return super(ConcurrentStubCollection, self).request(params)
+
+
+class ExecuteManyTest(TestCase, FixedTestDataMixin):
+    def test_execute_many(self):
+        model = self._create_model_for_test_data(self.test_data)
+        model.collection = ConcurrentStubCollection(data=self.test_data,
+                                                    concurrency=3)
+        queries = [model.select('foo'), model.select('bar'), model.prefix('ba')]
+        results = dict(execute_many(queries, max_workers=3))
+        self.assertTrue(model.collection.all_running.is_set())
+        self.assertEqual(set(results), set(queries))
+        self.assertEqual(results[queries[0]].first()._key, 'foo')
+        self.assertEqual(len(results[queries[2]].all()), 2)
+        # Prefetched results could be iterated again.
+        self.assertEqual(len(results[queries[2]].all()), 2)
+
+    def test_execute_many_models(self):
+        model1 = self._create_model_for_test_data(self.test_data)
+        model2 = self._create_model_for_test_data(self.test_data[:1])
+        results = list(execute_many([model1, model2], max_workers=2))
+        counts = [(model is model1, len(result.all()))
+                  for model, result in results]
+        self.assertEqual(sorted(counts), [(False, 1), (True, 3)])
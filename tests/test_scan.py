@@ -0,0 +1,85 @@
+from unittest import TestCase
+from collector.field import Field
+from collector.local import LocalCollection
+from collector.model import Model
+from collector.scan import _split_range
+
+
+class _TestModel(Model):
+    value = Field()
+
+
+class _FailingCollection(LocalCollection):
+    """ Fails every request whose number is in fail_on. """
+    def __init__(self, *args, **kwargs):
+        self.fail_on = kwargs.pop('fail_on', ())
+        self.requests = []
+        super(_FailingCollection, self).__init__(*args, **kwargs)
+
+    def request(self, params=None):
+        self.requests.append(params)
+        if len(self.requests) in self.fail_on:
+            raise Exception('Server returned unhandled response code: 500')
+        return super(_FailingCollection, self).request(params)
+
+
+class ParallelScanTest(TestCase):
+    def _create_model(self, **kwargs):
+        data = [{'_key': '%d_%03d' % (i % 4, i), '_ts': i, 'value': i}
+                for i in range(100)]
+        self.collection = _FailingCollection(data=data, **kwargs)
+        return _TestModel(self.collection)
+
+    def test_split_range(self):
+        self.assertEqual(_split_range(0, 9, 3), [(0, 2), (3, 5), (6, 9)])
+        self.assertEqual(_split_range(5, 6, 4), [(5, 5), (6, 6)])
+
+    def test_prefixes(self):
+        tm = self._create_model()
+        scan = tm.parallel_scan(shards=2, prefixes=['0', '1', '2', '3'],
+                                page_size=10)
+        self.assertEqual(len(scan), 2)
+        self.assertEqual(sorted(m.value for m in scan), range(100))
+        with self.assertRaises(ValueError):
+            tm.prefix('0').parallel_scan(prefixes=['0', '1'])
+
+    def test_ts_ranges(self):
+        tm = self._create_model()
+        scan = tm.parallel_scan(shards=3, startts=0, endts=99, raw=True)
+        self.assertEqual(sorted(d['value'] for d in scan), range(100))
+        scan = tm.when(startts=50, endts=59).parallel_scan(shards=5)
+        self.assertEqual(sorted(m.value for m in scan), range(50, 60))
+        # The given range takes precedence over the one of the query.
+        scan = tm.when(startts=50, endts=59).parallel_scan(startts=0,
+                                                           shards=2)
+        self.assertEqual(sorted(m.value for m in scan), range(60))
+        self.assertRaises(ValueError, tm.parallel_scan)
+
+    def test_shards(self):
+        tm = self._create_model()
+        shards = tm.when(startts=50, endts=99).parallel_scan(
+            prefixes=['0', '1'], page_size=10).shards()
+        self.assertEqual(len(shards), 2)
+        # The base query is combined with the shard prefixes.
+        self.assertEqual([m.value for m in shards[0]], range(52, 100, 4))
+        shards = tm.parallel_scan(prefixes=['0', '1'], page_size=10).shards()
+        self.assertEqual([len(page) for page in shards[1].pages()],
+                         [10, 10, 5])
+
+    def test_retry(self):
+        sleeps = []
+        tm = self._create_model(fail_on=(2, 3))
+        shard, = tm.parallel_scan(prefixes=['0'], page_size=10,
+                                  sleep=sleeps.append).shards()
+        self.assertEqual(sorted(m.value for m in shard), range(0, 100, 4))
+        self.assertEqual(sleeps, [1.0, 2.0])
+        # The failing page is requested again, starting after the last key.
+        self.assertEqual([dict(params).get('startafter')
+                          for params in self.collection.requests[:4]],
+                         [None, '0_036', '0_036', '0_036'])
+
+    def test_failure(self):
+        tm = self._create_model(fail_on=(1, 2))
+        scan = tm.parallel_scan(prefixes=['0', '1'], retries=1,
+                                sleep=lambda _: None, max_workers=1)
+        self.assertRaises(Exception, list, scan)
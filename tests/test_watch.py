@@ -0,0 +1,98 @@
+import os
+import shutil
+import tempfile
+from itertools import islice
+from unittest import TestCase
+from collector.field import Field
+from collector.model import Model
+from collector.watch import FileCheckpoint
+from helpers import StubCollection
+
+
+class _TestModel(Model):
+    value = Field()
+
+
+class WatchTest(TestCase):
+    def setUp(self):
+        self.sleeps = []
+        self.collection = StubCollection(data=[
+            {'_key': 'foo', '_ts': 1, 'value': 'foo_value'},
+            {'_key': 'bar', '_ts': 2, 'value': 'bar_value'},
+            {'_key': 'baz', '_ts': 2, 'value': 'baz_value'},
+        ])
+        self.tm = _TestModel(self.collection)
+
+    def _sleep(self, interval):
+        self.sleeps.append(interval)
+        # Data appears while sleeping.
+        if len(self.sleeps) == 3:
+            self.collection.data.append({'_key': 'qux', '_ts': 3})
+
+    def test_watch(self):
+        watcher = self.tm.watch(sleep=self._sleep, poll_interval=1,
+                                max_interval=3)
+        self.assertEqual([m._key for m in islice(watcher, 4)],
+                         ['bar', 'baz', 'foo', 'qux'])
+        self.assertEqual(self.sleeps, [1, 2, 3])
+        # The poll which yielded qux is not consumed completely yet.
+        self.assertEqual(watcher.ts, 2)
+        # Requested from the high-water mark, page by page.
+        self.assertIn(('startts', 2), self.collection.requests[1])
+        self.assertIn(('count', 1000), self.collection.requests[1])
+
+    def test_boundary_dedupe(self):
+        watcher = self.tm.watch(raw=True)
+        self.assertEqual(len(watcher.poll().all()), 3)
+        self.collection.data.append({'_key': 'qux', '_ts': 2})
+        self.collection.data[0]['_ts'] = 3
+        self.assertEqual([d['_key'] for d in watcher.poll()],
+                         ['foo', 'qux'])
+        self.assertEqual(watcher.poll().all(), [])
+        self.assertEqual(watcher.polls, 3)
+
+    def test_busy_collection(self):
+        watcher = self.tm.watch(page_size=2, sleep=self._sleep)
+        self.assertEqual(len(list(islice(watcher, 3))), 3)
+        self.assertEqual(len(self.collection.requests), 2)
+        self.assertEqual(self.sleeps, [])
+
+    def test_writes_during_poll(self):
+        self.collection.data.append({'_key': 'qux', '_ts': 2})
+        watcher = self.tm.watch(page_size=2, raw=True)
+        pages = watcher.poll().pages()
+        self.assertEqual([d['_key'] for d in next(pages)], ['bar', 'baz'])
+        # Written into the range which is paged past and ahead of the poll.
+        self.collection.data[1]['_ts'] = 5
+        self.collection.data.append({'_key': 'zzz', '_ts': 6})
+        self.assertEqual([d['_key'] for page in pages for d in page],
+                         ['foo', 'qux', 'zzz'])
+        # The mark is not moved past the first page of the poll.
+        self.assertEqual(watcher.ts, 2)
+        self.assertEqual([d['_key'] for d in watcher.poll()], ['bar'])
+        self.assertEqual(watcher.ts, 5)
+        self.assertEqual(watcher.poll().all(), [])
+        self.assertEqual(watcher.ts, 6)
+
+    def test_query(self):
+        watcher = self.tm.prefix('ba').when(startts=2).watch(raw=True)
+        self.assertEqual([d['_key'] for d in watcher.poll()], ['bar', 'baz'])
+        self.assertEqual(watcher.poll().all(), [])
+
+    def test_checkpoint(self):
+        tmp_dir = tempfile.mkdtemp()
+        try:
+            checkpoint = FileCheckpoint(os.path.join(tmp_dir, 'checkpoint'))
+            self.tm.watch(checkpoint=checkpoint).poll().all()
+            self.assertEqual(checkpoint.load(),
+                             (2, [['bar', 2], ['baz', 2]]))
+            self.collection.data.append({'_key': 'qux', '_ts': 2})
+            watcher = self.tm.watch(checkpoint=checkpoint, raw=True)
+            self.assertEqual(watcher.poll().all(),
+                             [{'_key': 'qux', '_ts': 2}])
+            # Checkpoints which have the keys at the mark only.
+            checkpoint.save(2, ['bar', 'baz', 'qux'])
+            watcher = self.tm.watch(checkpoint=checkpoint, raw=True)
+            self.assertEqual(watcher.poll().all(), [])
+        finally:
+            shutil.rmtree(tmp_dir)